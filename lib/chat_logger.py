@@ -1,50 +1,180 @@
-"""チャットログ記録（JSONL形式）"""
+"""チャットログ記録（gzip圧縮JSONL形式）"""
 
-import json
+import atexit
+import gzip
+import logging
+import queue
+import threading
+import time
+from collections import deque
+from collections.abc import Iterator
 from datetime import datetime, timezone
 from pathlib import Path
 
+import orjson
+
 
 LOG_DIR = Path("/tmp/chat_logs")
-LOG_FILE = LOG_DIR / "chat_log.jsonl"
+LOG_FILE = LOG_DIR / "chat_log.jsonl.gz"
+# 件数・先頭・末尾のタイムスタンプを保持するサイドカー（圧縮ログは末尾から読めないため）
+STATS_FILE = LOG_DIR / "chat_log.stats.json"
+
+# バックグラウンド書き込みの間隔（秒）
+FLUSH_INTERVAL = 0.1
+
+logger = logging.getLogger(__name__)
+
+_queue: queue.Queue[bytes] = queue.Queue()
+_writer_lock = threading.Lock()
+_writer: threading.Thread | None = None
+# ログ本体とサイドカーの更新を一組で行うためのロック
+_file_lock = threading.Lock()
+
+
+def _writer_loop() -> None:
+    """キューに溜まった行をまとめて1つのgzipメンバーとして追記する。
+
+    バッチごとに閉じて完結したメンバーにするため、読み込み側はいつでも全行を読める。
+    書き込みに失敗してもスレッドは止めない
+    （取り出した行を完了扱いにしないと flush_logs が戻らなくなるため）。
+    """
+    while True:
+        lines = [_queue.get()]
+        while True:
+            try:
+                lines.append(_queue.get_nowait())
+            except queue.Empty:
+                break
+        try:
+            # 起動後にディレクトリが消されても書き込めるよう、バッチごとに作り直す
+            LOG_DIR.mkdir(parents=True, exist_ok=True)
+            with _file_lock:
+                stats = _load_stats()
+                with gzip.open(LOG_FILE, "ab", compresslevel=1) as f:
+                    f.write(b"".join(lines))
+                stats["total"] += len(lines)
+                stats["oldest"] = stats["oldest"] or _parse_line(lines[0]).get("timestamp")
+                stats["newest"] = _parse_line(lines[-1]).get("timestamp")
+                stats["size"] = LOG_FILE.stat().st_size
+                STATS_FILE.write_bytes(orjson.dumps(stats))
+        except Exception:
+            logger.exception("チャットログの書き込みに失敗しました（%d件）", len(lines))
+        finally:
+            for _ in lines:
+                _queue.task_done()
+        time.sleep(FLUSH_INTERVAL)
+
+
+def _ensure_writer() -> None:
+    global _writer
+    with _writer_lock:
+        if _writer is None or not _writer.is_alive():
+            _writer = threading.Thread(target=_writer_loop, name="chat-log-writer", daemon=True)
+            _writer.start()
+
+
+def flush_logs() -> None:
+    """未書き込みのログがファイルに反映されるまで待つ。"""
+    if _writer is not None and _writer.is_alive():
+        _queue.join()
+
+
+atexit.register(flush_logs)
 
 
 def log_chat(question: str, answer: str, sources: list[dict]) -> None:
-    """チャットのQ&Aを1行JSONとして記録する。"""
-    LOG_DIR.mkdir(parents=True, exist_ok=True)
+    """チャットのQ&Aを1行JSONとして記録する（書き込みはバックグラウンドで行う）。"""
     entry = {
-        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "timestamp": datetime.now(timezone.utc),
         "question": question,
         "answer": answer,
         "sources": [s.get("page_title", "") for s in sources],
     }
-    with open(LOG_FILE, "a", encoding="utf-8") as f:
-        f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+    _ensure_writer()
+    _queue.put(orjson.dumps(entry, option=orjson.OPT_APPEND_NEWLINE))
 
 
-def read_logs() -> list[dict]:
-    """ログファイルを読み込み、エントリのリストを返す。"""
+def iter_logs() -> Iterator[dict]:
+    """ログファイルを1行ずつパースしてエントリを順に返す。"""
+    flush_logs()
     if not LOG_FILE.exists():
-        return []
-    entries = []
-    with open(LOG_FILE, "r", encoding="utf-8") as f:
-        for line in f:
-            line = line.strip()
-            if line:
-                try:
-                    entries.append(json.loads(line))
-                except json.JSONDecodeError:
-                    continue
-    return entries
+        return
+    with gzip.open(LOG_FILE, "rb") as f:
+        try:
+            for line in f:
+                line = line.strip()
+                if line:
+                    try:
+                        yield orjson.loads(line)
+                    except orjson.JSONDecodeError:
+                        continue
+        except EOFError:
+            # 書き込み途中のメンバーは読み飛ばす
+            return
+
+
+def read_logs(limit: int | None = None, offset: int = 0) -> list[dict]:
+    """ログを新しい順に返す。limit 指定時は新しい側から offset 件飛ばして limit 件だけ返す。
+
+    圧縮ログは末尾から読めないため先頭から展開するが、保持するのは offset + limit 件までに留める。
+    """
+    if limit is None:
+        logs = list(iter_logs())
+    else:
+        logs = list(deque(iter_logs(), maxlen=offset + limit))
+    logs.reverse()
+    return logs[offset:] if limit is None else logs[offset:offset + limit]
 
 
 def get_log_stats() -> dict:
-    """ログの統計情報を返す。"""
-    entries = read_logs()
-    if not entries:
+    """ログの統計情報を返す。通常はサイドカーを読むだけで、ログ本体は展開しない。"""
+    flush_logs()
+    with _file_lock:
+        stats = _load_stats()
+    return {"total": stats["total"], "oldest": stats["oldest"], "newest": stats["newest"]}
+
+
+def _load_stats() -> dict:
+    """サイドカーの統計を読む。ログ本体のサイズと食い違う場合は再集計して保存し直す。"""
+    if not LOG_FILE.exists():
+        return {"total": 0, "oldest": None, "newest": None, "size": 0}
+    size = LOG_FILE.stat().st_size
+    try:
+        stats = orjson.loads(STATS_FILE.read_bytes())
+        if stats.get("size") == size:
+            return stats
+    except (OSError, orjson.JSONDecodeError):
+        pass
+    stats = {**_scan_log_stats(), "size": size}
+    STATS_FILE.write_bytes(orjson.dumps(stats))
+    return stats
+
+
+def _scan_log_stats() -> dict:
+    """ログ全体を1パスで走査し、件数・先頭・末尾のタイムスタンプを求める。"""
+    total = 0
+    first_line = last_line = b""
+    with gzip.open(LOG_FILE, "rb") as f:
+        try:
+            for line in f:
+                if line.strip():
+                    if not total:
+                        first_line = line
+                    last_line = line
+                    total += 1
+        except EOFError:
+            pass
+    if not total:
         return {"total": 0, "oldest": None, "newest": None}
     return {
-        "total": len(entries),
-        "oldest": entries[0].get("timestamp"),
-        "newest": entries[-1].get("timestamp"),
+        "total": total,
+        "oldest": _parse_line(first_line).get("timestamp"),
+        "newest": _parse_line(last_line).get("timestamp"),
     }
+
+
+def _parse_line(line: bytes) -> dict:
+    try:
+        return orjson.loads(line)
+    except orjson.JSONDecodeError:
+        return {}
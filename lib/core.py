@@ -1,20 +1,24 @@
 """ビジネスロジック: データモデル、NotionLoader、ImageProcessor、Chunker、VectorStore、RAGChain"""
 
+import asyncio
 import hashlib
-import json
 import mimetypes
+import re
 import base64
+from collections.abc import AsyncIterator
+from concurrent.futures import ThreadPoolExecutor
 from dataclasses import dataclass, field
 from datetime import datetime, timezone
 from enum import Enum
+from functools import lru_cache
 from pathlib import Path
 
 import httpx
+import orjson
 import streamlit as st
-from openai import OpenAI
-import chromadb
-from chromadb.config import Settings as ChromaSettings
-from notion_client import Client as NotionClient
+from streamlit.runtime.scriptrunner import add_script_run_ctx, get_script_run_ctx
+from openai import AsyncOpenAI, OpenAI
+from notion_client import AsyncClient as AsyncNotionClient
 
 
 # ==================== データモデル ====================
@@ -39,7 +43,7 @@ class BlockType(Enum):
     UNKNOWN = "unknown"
 
 
-@dataclass
+@dataclass(slots=True)
 class ImageInfo:
     url: str
     local_path: str | None = None
@@ -47,7 +51,7 @@ class ImageInfo:
     caption: str | None = None
 
 
-@dataclass
+@dataclass(slots=True)
 class NotionBlock:
     id: str
     type: BlockType
@@ -57,24 +61,30 @@ class NotionBlock:
     metadata: dict = field(default_factory=dict)
 
 
-@dataclass
+@dataclass(slots=True)
 class NotionPage:
     id: str
     title: str
     url: str
     blocks: list[NotionBlock] = field(default_factory=list)
     metadata: dict = field(default_factory=dict)
+    # __slots__ では cached_property が使えないため、走査結果をフィールドで保持する
+    _images: list[ImageInfo] | None = field(default=None, init=False, repr=False, compare=False)
 
     @property
     def images(self) -> list[ImageInfo]:
-        def collect_images(blocks: list[NotionBlock]) -> list[ImageInfo]:
-            images = []
-            for block in blocks:
-                if block.image:
-                    images.append(block.image)
-                images.extend(collect_images(block.children))
-            return images
-        return collect_images(self.blocks)
+        if self._images is not None:
+            return self._images
+        # 再帰せず明示的なスタックで走査（ブロック順を保つため逆順に積む）
+        images = []
+        stack = list(reversed(self.blocks))
+        while stack:
+            block = stack.pop()
+            if block.image:
+                images.append(block.image)
+            stack.extend(reversed(block.children))
+        self._images = images
+        return images
 
 
 @dataclass
@@ -93,19 +103,29 @@ class Chunk:
 _CONFIG_FILE = Path("/tmp/notion_bot_config.json")
 
 
+@lru_cache(maxsize=1)
+def _load_config_cached(mtime_ns: int) -> dict:
+    """更新時刻ごとに一度だけ設定ファイルをパースする。"""
+    try:
+        return orjson.loads(_CONFIG_FILE.read_bytes())
+    except (orjson.JSONDecodeError, OSError):
+        return {}
+
+
 def _load_config() -> dict:
     """永続化設定ファイルを読み込む。"""
-    if _CONFIG_FILE.exists():
-        try:
-            return json.loads(_CONFIG_FILE.read_text(encoding="utf-8"))
-        except (json.JSONDecodeError, OSError):
-            return {}
-    return {}
+    try:
+        mtime_ns = _CONFIG_FILE.stat().st_mtime_ns
+    except OSError:
+        return {}
+    # 呼び出し側が変更してもキャッシュを汚さないようコピーを返す
+    return dict(_load_config_cached(mtime_ns))
 
 
 def _save_config(config: dict) -> None:
     """永続化設定ファイルに書き込む。"""
-    _CONFIG_FILE.write_text(json.dumps(config, ensure_ascii=False), encoding="utf-8")
+    _CONFIG_FILE.write_bytes(orjson.dumps(config))
+    _load_config_cached.cache_clear()
 
 
 def save_page_ids(page_ids: str) -> None:
@@ -153,16 +173,23 @@ def needs_resync(interval_hours: float = 1.0) -> bool:
         return True
 
 
-def get_settings():
-    """Streamlit secretsまたはsession_stateから設定を取得"""
-    settings = {}
-
+@st.cache_data
+def _load_secrets() -> dict:
+    """Streamlit secretsの値を読み込む（プロセス内で一度だけ）。"""
     try:
-        settings['notion_token'] = st.secrets.get('NOTION_TOKEN', '')
-        settings['openai_api_key'] = st.secrets.get('OPENAI_API_KEY', '')
-        settings['notion_page_ids'] = st.secrets.get('NOTION_PAGE_IDS', '')
+        return {
+            'notion_token': st.secrets.get('NOTION_TOKEN', ''),
+            'openai_api_key': st.secrets.get('OPENAI_API_KEY', ''),
+            'notion_page_ids': st.secrets.get('NOTION_PAGE_IDS', ''),
+        }
     except Exception:
-        pass
+        return {}
+
+
+def get_settings():
+    """Streamlit secretsまたはsession_stateから設定を取得"""
+    # session_stateと設定ファイルはセッション・保存ごとに変わるため、キャッシュするのはsecretsのみ
+    settings = _load_secrets()
 
     # ファイル永続化を優先
     saved_token = load_notion_token()
@@ -180,24 +207,69 @@ def get_settings():
     return settings
 
 
+@st.cache_resource
+def get_openai_client(openai_api_key: str) -> OpenAI:
+    """APIキーごとにOpenAIクライアントを共有する。"""
+    return OpenAI(api_key=openai_api_key)
+
+
 # ==================== Notionローダー ====================
 
 class NotionLoader:
+    MAX_CONCURRENCY = 8
+
     def __init__(self, token: str, page_ids: list[str]):
-        self.client = NotionClient(auth=token)
+        self.token = token
         self.page_ids = page_ids
 
     def load_all_pages(self) -> list[NotionPage]:
-        pages = []
-        for page_id in self.page_ids:
-            if page_id.strip():
-                page = self.load_page(page_id.strip())
-                pages.append(page)
-        return pages
+        page_ids = [page_id.strip() for page_id in self.page_ids if page_id.strip()]
+        return asyncio.run(self._load_pages(page_ids))
 
     def load_page(self, page_id: str) -> NotionPage:
-        raw_page = self.client.pages.retrieve(page_id=page_id)
-        raw_blocks = self._get_blocks_recursive(page_id)
+        return asyncio.run(self._load_pages([page_id]))[0]
+
+    async def _load_pages(self, page_ids: list[str]) -> list[NotionPage]:
+        """ページ取得を並行実行する。同時リクエスト数はセマフォで制限する。"""
+        semaphore = asyncio.Semaphore(self.MAX_CONCURRENCY)
+        async with AsyncNotionClient(auth=self.token) as client:
+            pages = await asyncio.gather(
+                *(self._load_page(client, semaphore, page_id) for page_id in page_ids)
+            )
+        return list(pages)
+
+    async def iter_pages(
+        self, known_versions: dict[str, str | None] | None = None
+    ) -> AsyncIterator[NotionPage]:
+        """読み込みが完了したページから順に返す（順序は保証しない）。
+
+        known_versionsの last_edited_time と一致するページは本文を取得せずスキップする。
+        """
+        known_versions = known_versions or {}
+        page_ids = [page_id.strip() for page_id in self.page_ids if page_id.strip()]
+        semaphore = asyncio.Semaphore(self.MAX_CONCURRENCY)
+        async with AsyncNotionClient(auth=self.token) as client:
+            tasks = [
+                self._load_page(client, semaphore, page_id, known_versions.get(page_id))
+                for page_id in page_ids
+            ]
+            for next_page in asyncio.as_completed(tasks):
+                page = await next_page
+                if page is not None:
+                    yield page
+
+    async def _load_page(
+        self,
+        client: AsyncNotionClient,
+        semaphore: asyncio.Semaphore,
+        page_id: str,
+        known_version: str | None = None,
+    ) -> NotionPage | None:
+        async with semaphore:
+            raw_page = await client.pages.retrieve(page_id=page_id)
+        if known_version is not None and raw_page.get("last_edited_time") == known_version:
+            return None
+        raw_blocks = await self._get_blocks_recursive(client, semaphore, page_id)
         title = self._extract_title(raw_page)
         url = raw_page.get("url", "")
         blocks = [self._parse_block(b) for b in raw_blocks]
@@ -209,21 +281,39 @@ class NotionLoader:
             metadata={
                 "created_time": raw_page.get("created_time"),
                 "last_edited_time": raw_page.get("last_edited_time"),
+                "has_child_pages": self._has_child_pages(raw_blocks),
             },
         )
 
-    def _get_blocks_recursive(self, block_id: str) -> list[dict]:
+    def _has_child_pages(self, raw_blocks: list[dict]) -> bool:
+        # 子ページの編集は親ページの last_edited_time に反映されない
+        stack = list(raw_blocks)
+        while stack:
+            block = stack.pop()
+            if block.get("type") == BlockType.CHILD_PAGE.value:
+                return True
+            stack.extend(block.get("children", []))
+        return False
+
+    async def _get_blocks_recursive(
+        self, client: AsyncNotionClient, semaphore: asyncio.Semaphore, block_id: str
+    ) -> list[dict]:
         blocks = []
         cursor = None
         while True:
-            response = self.client.blocks.children.list(block_id=block_id, start_cursor=cursor)
-            for block in response["results"]:
-                if block.get("has_children"):
-                    block["children"] = self._get_blocks_recursive(block["id"])
-                blocks.append(block)
+            async with semaphore:
+                response = await client.blocks.children.list(block_id=block_id, start_cursor=cursor)
+            blocks.extend(response["results"])
             if not response.get("has_more"):
                 break
             cursor = response.get("next_cursor")
+        # 子ブロックを持つブロックはまとめて並行取得する
+        parents = [block for block in blocks if block.get("has_children")]
+        children = await asyncio.gather(
+            *(self._get_blocks_recursive(client, semaphore, block["id"]) for block in parents)
+        )
+        for block, child_blocks in zip(parents, children):
+            block["children"] = child_blocks
         return blocks
 
     def _extract_title(self, page: dict) -> str:
@@ -244,10 +334,7 @@ class NotionLoader:
     def _parse_block(self, block: dict) -> NotionBlock:
         block_id = block.get("id", "")
         block_type_str = block.get("type", "unknown")
-        try:
-            block_type = BlockType(block_type_str)
-        except ValueError:
-            block_type = BlockType.UNKNOWN
+        block_type = BlockType._value2member_map_.get(block_type_str, BlockType.UNKNOWN)
         text = ""
         image = None
         metadata = {}
@@ -289,10 +376,32 @@ class NotionLoader:
 # ==================== 画像処理 ====================
 
 class ImageProcessor:
+    MAX_WORKERS = 16
+    MAX_RETRIES = 5
+
     def __init__(self, openai_api_key: str):
-        self.openai_client = OpenAI(api_key=openai_api_key)
+        # 並列実行でレート制限(429)に当たりやすいため、SDKのバックオフ付きリトライ回数を増やす
+        self.openai_client = get_openai_client(openai_api_key).with_options(
+            max_retries=self.MAX_RETRIES
+        )
+        self.http_client = httpx.Client(timeout=30.0, follow_redirects=True)
+        # ワーカースレッドからもst.warningを出せるよう、生成時のScriptRunContextを保持する
+        self._script_ctx = get_script_run_ctx()
         self.storage_dir = Path("/tmp/notion_images")
         self.storage_dir.mkdir(parents=True, exist_ok=True)
+        self.description_cache_dir = self.storage_dir / ".desc_cache"
+        self.description_cache_dir.mkdir(exist_ok=True)
+
+    def process_images(self, images: list[ImageInfo]) -> list[ImageInfo]:
+        """複数画像をスレッドプールで並列処理する（I/O待ちが支配的なため）。"""
+        if not images:
+            return []
+        with ThreadPoolExecutor(
+            max_workers=min(self.MAX_WORKERS, len(images)),
+            initializer=add_script_run_ctx,
+            initargs=(None, self._script_ctx),
+        ) as executor:
+            return list(executor.map(self.process_image, images))
 
     def process_image(self, image: ImageInfo) -> ImageInfo:
         if not image.url:
@@ -307,16 +416,15 @@ class ImageProcessor:
 
     def _download_image(self, url: str) -> Path | None:
         try:
-            url_hash = hashlib.md5(url.encode()).hexdigest()[:16]
-            with httpx.Client(timeout=30.0, follow_redirects=True) as client:
-                response = client.get(url)
-                response.raise_for_status()
-                content_type = response.headers.get("content-type", "image/png")
-                ext = mimetypes.guess_extension(content_type.split(";")[0]) or ".png"
-                filename = f"{url_hash}{ext}"
-                local_path = self.storage_dir / filename
-                local_path.write_bytes(response.content)
-                return local_path
+            url_hash = hashlib.blake2b(url.encode(), digest_size=8).hexdigest()
+            response = self.http_client.get(url)
+            response.raise_for_status()
+            content_type = response.headers.get("content-type", "image/png")
+            ext = mimetypes.guess_extension(content_type.split(";")[0]) or ".png"
+            filename = f"{url_hash}{ext}"
+            local_path = self.storage_dir / filename
+            local_path.write_bytes(response.content)
+            return local_path
         except Exception as e:
             st.warning(f"画像ダウンロードエラー: {e}")
             return None
@@ -324,6 +432,9 @@ class ImageProcessor:
     def _generate_description(self, image_path: Path, caption: str | None) -> str:
         try:
             image_data = image_path.read_bytes()
+            cache_path = self._description_cache_path(image_data, caption)
+            if cache_path.exists():
+                return cache_path.read_text(encoding="utf-8")
             base64_image = base64.b64encode(image_data).decode("utf-8")
             mime_type, _ = mimetypes.guess_type(str(image_path))
             mime_type = mime_type or "image/png"
@@ -341,16 +452,38 @@ class ImageProcessor:
                 }],
                 max_tokens=500,
             )
-            return response.choices[0].message.content or ""
+            description = response.choices[0].message.content or ""
+            cache_path.write_text(description, encoding="utf-8")
+            return description
         except Exception as e:
             st.warning(f"画像説明生成エラー: {e}")
             return caption or ""
 
+    def _description_cache_path(self, image_data: bytes, caption: str | None) -> Path:
+        """画像内容とキャプションのハッシュから説明キャッシュのパスを決める。
+
+        NotionのファイルURLは署名付きで毎回変わるため、URLではなく画像の中身をキーにする。
+        """
+        digest = hashlib.blake2b(image_data, digest_size=16)
+        digest.update(b"|" + (caption or "").encode())
+        return self.description_cache_dir / f"{digest.hexdigest()}.txt"
+
 
 # ==================== チャンカー ====================
 
 class Chunker:
     HEADING_TYPES = {BlockType.HEADING_1, BlockType.HEADING_2, BlockType.HEADING_3}
+    # ブロックタイプごとの (プレフィックス, サフィックス)
+    _FORMAT_TABLE = {
+        BlockType.HEADING_1: ("# ", ""),
+        BlockType.HEADING_2: ("## ", ""),
+        BlockType.HEADING_3: ("### ", ""),
+        BlockType.BULLETED_LIST_ITEM: ("• ", ""),
+        BlockType.NUMBERED_LIST_ITEM: ("1. ", ""),
+        BlockType.QUOTE: ("> ", ""),
+        BlockType.CODE: ("```\n", "\n```"),
+    }
+    _NO_FORMAT = ("", "")
 
     def __init__(self, chunk_size: int = 1000, chunk_overlap: int = 200):
         self.chunk_size = chunk_size
@@ -367,31 +500,34 @@ class Chunker:
     def _split_into_sections(self, blocks: list[NotionBlock]) -> list[list[NotionBlock]]:
         sections = []
         current_section = []
-
-        def process_blocks(blocks: list[NotionBlock]):
-            nonlocal current_section
-            for block in blocks:
-                if block.type in self.HEADING_TYPES:
-                    if current_section:
-                        sections.append(current_section)
-                    current_section = [block]
-                else:
-                    current_section.append(block)
-                if block.children:
-                    for child in block.children:
-                        if child.type not in self.HEADING_TYPES:
-                            current_section.append(child)
-                        else:
-                            process_blocks([child])
-
-        process_blocks(blocks)
+        # 再帰の代わりに (子イテレータ, トップレベルか) のスタックで1パス走査する。
+        # トップレベル以外では見出しだけが新セクションを開き、その子も走査対象になる。
+        stack = [(iter(blocks), True)]
+        while stack:
+            block = next(stack[-1][0], None)
+            if block is None:
+                stack.pop()
+                continue
+            is_heading = block.type in self.HEADING_TYPES
+            if is_heading:
+                if current_section:
+                    sections.append(current_section)
+                current_section = [block]
+            else:
+                current_section.append(block)
+                if not stack[-1][1]:
+                    continue
+            if block.children:
+                stack.append((iter(block.children), False))
         if current_section:
             sections.append(current_section)
         return sections
 
     def _create_chunks_from_section(self, section: list[NotionBlock], page: NotionPage, section_index: int) -> list[Chunk]:
         chunks = []
-        current_text = ""
+        # 文字列の繰り返し連結を避け、パーツをリストに溜めてチャンク出力時に一度だけjoinする
+        current_parts: list[str] = []
+        current_len = 0
         current_images = []
         chunk_index = 0
 
@@ -400,7 +536,11 @@ class Chunker:
             block_images = self._get_block_images(block)
 
             if block_images:
-                combined_text = current_text + "\n" + block_text if current_text else block_text
+                if current_len:
+                    current_parts.append(block_text)
+                else:
+                    current_parts = [block_text]
+                combined_text = "\n".join(current_parts)
                 combined_images = current_images + block_images
                 if combined_text.strip() or combined_images:
                     chunk = Chunk(
@@ -414,11 +554,13 @@ class Chunker:
                     )
                     chunks.append(chunk)
                     chunk_index += 1
-                current_text = ""
+                current_parts = []
+                current_len = 0
                 current_images = []
             else:
-                new_text = current_text + "\n" + block_text if current_text else block_text
-                if len(new_text) > self.chunk_size:
+                new_len = current_len + 1 + len(block_text) if current_len else len(block_text)
+                if new_len > self.chunk_size:
+                    current_text = "\n".join(current_parts)
                     if current_text.strip():
                         chunk = Chunk(
                             id=f"{page.id}_{section_index}_{chunk_index}",
@@ -433,13 +575,20 @@ class Chunker:
                         chunk_index += 1
                     if self.chunk_overlap > 0 and current_text:
                         overlap_text = current_text[-self.chunk_overlap:]
-                        current_text = overlap_text + "\n" + block_text
+                        current_parts = [overlap_text, block_text]
+                        current_len = len(overlap_text) + 1 + len(block_text)
                     else:
-                        current_text = block_text
+                        current_parts = [block_text]
+                        current_len = len(block_text)
                     current_images = []
+                elif current_len:
+                    current_parts.append(block_text)
+                    current_len = new_len
                 else:
-                    current_text = new_text
+                    current_parts = [block_text]
+                    current_len = new_len
 
+        current_text = "\n".join(current_parts)
         if current_text.strip():
             chunk = Chunk(
                 id=f"{page.id}_{section_index}_{chunk_index}",
@@ -454,24 +603,14 @@ class Chunker:
         return chunks
 
     def _get_block_text(self, block: NotionBlock) -> str:
-        text_parts = []
-        prefix_map = {
-            BlockType.HEADING_1: "# ",
-            BlockType.HEADING_2: "## ",
-            BlockType.HEADING_3: "### ",
-            BlockType.BULLETED_LIST_ITEM: "• ",
-            BlockType.NUMBERED_LIST_ITEM: "1. ",
-            BlockType.QUOTE: "> ",
-            BlockType.CODE: "```\n",
-        }
-        suffix_map = {BlockType.CODE: "\n```"}
-        prefix = prefix_map.get(block.type, "")
-        suffix = suffix_map.get(block.type, "")
+        text = ""
         if block.text:
-            text_parts.append(f"{prefix}{block.text}{suffix}")
+            prefix, suffix = self._FORMAT_TABLE.get(block.type, self._NO_FORMAT)
+            text = prefix + block.text + suffix
         if block.image and block.image.description:
-            text_parts.append(f"[画像説明: {block.image.description}]")
-        return "\n".join(text_parts)
+            description = f"[画像説明: {block.image.description}]"
+            return f"{text}\n{description}" if text else description
+        return text
 
     def _get_block_images(self, block: NotionBlock) -> list[str]:
         images = []
@@ -482,12 +621,38 @@ class Chunker:
 
 # ==================== ベクトルストア ====================
 
+# メタデータはスカラーしか持てないため、画像パスのリストは区切り文字で連結して保存する
+IMAGE_PATH_SEPARATOR = "\n"
+
+
+def _join_image_paths(image_paths: list[str]) -> str:
+    return IMAGE_PATH_SEPARATOR.join(image_paths)
+
+
+def _split_image_paths(value: str) -> list[str]:
+    # 以前の形式（JSON配列）で保存されたチャンクも読めるようにする
+    if value.startswith("["):
+        return orjson.loads(value)
+    return value.split(IMAGE_PATH_SEPARATOR) if value else []
+
+
 class VectorStore:
     COLLECTION_NAME = "notion_pages"
     PERSIST_DIR = "/tmp/notion_bot_chroma"
+    EMBEDDING_MODEL = "text-embedding-3-small"
+    EMBED_BATCH_SIZE = 64
+    EMBED_CONCURRENCY = 8
+    UPSERT_BATCH_SIZE = 100
+    # ページIDごとの前回同期時の last_edited_time
+    MANIFEST_FILE = Path(PERSIST_DIR) / "manifest.json"
 
     def __init__(self, openai_api_key: str):
-        self.openai_client = OpenAI(api_key=openai_api_key)
+        self.openai_api_key = openai_api_key
+        self.openai_client = get_openai_client(openai_api_key)
+        # chromadb は読み込みが重いため、設定画面などストアを使わない再実行では読み込まない
+        import chromadb
+        from chromadb.config import Settings as ChromaSettings
+
         self.client = chromadb.PersistentClient(
             path=self.PERSIST_DIR,
             settings=ChromaSettings(anonymized_telemetry=False),
@@ -496,46 +661,81 @@ class VectorStore:
             name=self.COLLECTION_NAME,
             metadata={"hnsw:space": "cosine"},
         )
+        # 同一質問の再埋め込みを避けるためのLRUキャッシュ
+        self._embed_cached = lru_cache(maxsize=1024)(self._embed_uncached)
 
     def embed(self, text: str) -> list[float]:
+        return list(self._embed_cached(text))
+
+    def _embed_uncached(self, text: str) -> tuple[float, ...]:
         response = self.openai_client.embeddings.create(
-            model="text-embedding-3-small",
+            model=self.EMBEDDING_MODEL,
             input=text,
         )
-        return response.data[0].embedding
+        return tuple(response.data[0].embedding)
 
     def embed_batch(self, texts: list[str]) -> list[list[float]]:
         if not texts:
             return []
-        batch_size = 100
-        all_embeddings = []
-        for i in range(0, len(texts), batch_size):
-            batch = texts[i:i + batch_size]
-            response = self.openai_client.embeddings.create(
-                model="text-embedding-3-small",
-                input=batch,
-            )
-            embeddings = [item.embedding for item in response.data]
-            all_embeddings.extend(embeddings)
-        return all_embeddings
+        return asyncio.run(self.embed_batch_async(texts))
+
+    async def embed_batch_async(self, texts: list[str]) -> list[list[float]]:
+        """バッチごとの埋め込みリクエストを並行実行する。"""
+        semaphore = asyncio.Semaphore(self.EMBED_CONCURRENCY)
+
+        async def embed_one(client: AsyncOpenAI, batch: list[str]) -> list[list[float]]:
+            async with semaphore:
+                response = await client.embeddings.create(model=self.EMBEDDING_MODEL, input=batch)
+            return [item.embedding for item in response.data]
+
+        # 定型文など同一テキストは一度だけ埋め込み、結果を元の位置に戻す
+        unique_texts = list(dict.fromkeys(texts))
+        batches = [
+            unique_texts[i:i + self.EMBED_BATCH_SIZE]
+            for i in range(0, len(unique_texts), self.EMBED_BATCH_SIZE)
+        ]
+        async with AsyncOpenAI(api_key=self.openai_api_key) as client:
+            results = await asyncio.gather(*(embed_one(client, batch) for batch in batches))
+        embeddings = dict(
+            zip(unique_texts, (embedding for batch in results for embedding in batch))
+        )
+        return [embeddings[text] for text in texts]
 
     def add_chunks(self, chunks: list[Chunk]) -> None:
         if not chunks:
             return
-        texts = [chunk.text for chunk in chunks]
-        embeddings = self.embed_batch(texts)
-        ids = [chunk.id for chunk in chunks]
-        metadatas = [
-            {
-                "page_id": chunk.page_id,
-                "page_title": chunk.page_title,
-                "page_url": chunk.page_url,
-                "image_paths": json.dumps(chunk.image_paths),
-                "section_index": chunk.metadata.get("section_index", 0),
-            }
-            for chunk in chunks
-        ]
-        self.collection.upsert(ids=ids, embeddings=embeddings, documents=texts, metadatas=metadatas)
+        asyncio.run(self.add_chunks_async(chunks))
+
+    async def add_chunks_async(self, chunks: list[Chunk]) -> None:
+        if not chunks:
+            return
+        embeddings = await self.embed_batch_async([chunk.text for chunk in chunks])
+        await self.upsert_async(chunks, embeddings)
+
+    async def upsert_async(self, chunks: list[Chunk], embeddings: list[list[float]]) -> None:
+        """Chromaへの書き込みをワーカースレッドで行い、イベントループを塞がない。"""
+        await asyncio.to_thread(self._upsert, chunks, embeddings)
+
+    def _upsert(self, chunks: list[Chunk], embeddings: list[list[float]]) -> None:
+        # 一度に大量に書き込むとインデックス更新で長く止まるため、小分けにする
+        for i in range(0, len(chunks), self.UPSERT_BATCH_SIZE):
+            batch = chunks[i:i + self.UPSERT_BATCH_SIZE]
+            metadatas = [
+                {
+                    "page_id": chunk.page_id,
+                    "page_title": chunk.page_title,
+                    "page_url": chunk.page_url,
+                    "image_paths": _join_image_paths(chunk.image_paths),
+                    "section_index": chunk.metadata.get("section_index", 0),
+                }
+                for chunk in batch
+            ]
+            self.collection.upsert(
+                ids=[chunk.id for chunk in batch],
+                embeddings=embeddings[i:i + self.UPSERT_BATCH_SIZE],
+                documents=[chunk.text for chunk in batch],
+                metadatas=metadatas,
+            )
 
     def search(self, query: str, top_k: int = 5) -> list[dict]:
         query_embedding = self.embed(query)
@@ -549,7 +749,7 @@ class VectorStore:
             for i, doc in enumerate(results["documents"][0]):
                 metadata = results["metadatas"][0][i] if results["metadatas"] else {}
                 distance = results["distances"][0][i] if results["distances"] else 0
-                image_paths = json.loads(metadata.get("image_paths", "[]"))
+                image_paths = _split_image_paths(metadata.get("image_paths", ""))
                 search_results.append({
                     "text": doc,
                     "page_id": metadata.get("page_id", ""),
@@ -566,11 +766,30 @@ class VectorStore:
             name=self.COLLECTION_NAME,
             metadata={"hnsw:space": "cosine"},
         )
+        self.MANIFEST_FILE.unlink(missing_ok=True)
+
+    def delete_page(self, page_id: str) -> None:
+        self.collection.delete(where={"page_id": page_id})
+
+    def load_manifest(self) -> dict[str, str | None]:
+        try:
+            return orjson.loads(self.MANIFEST_FILE.read_bytes())
+        except (orjson.JSONDecodeError, OSError):
+            return {}
+
+    def save_manifest(self, manifest: dict[str, str | None]) -> None:
+        self.MANIFEST_FILE.write_bytes(orjson.dumps(manifest))
 
     def get_stats(self) -> dict:
         return {"total_chunks": self.collection.count()}
 
 
+@st.cache_resource
+def get_vector_store(openai_api_key: str) -> VectorStore:
+    """APIキーごとにVectorStoreを共有し、Chromaクライアントの再生成を避ける。"""
+    return VectorStore(openai_api_key)
+
+
 # ==================== RAGチェーン ====================
 
 SYSTEM_PROMPT = """あなたは社内ドキュメント（Notion）に基づいて質問に答えるアシスタントです。
@@ -594,6 +813,10 @@ RAG_PROMPT_TEMPLATE = """以下はNotionドキュメントから取得した関
 質問: {question}
 """
 
+NO_RESULTS_ANSWER = (
+    "申し訳ありませんが、この質問に関連する情報がドキュメントに見つかりませんでした。"
+)
+
 
 def format_context(search_results: list[dict]) -> str:
     context_parts = []
@@ -606,55 +829,101 @@ def format_context(search_results: list[dict]) -> str:
 
 class RAGChain:
     def __init__(self, openai_api_key: str, vector_store: VectorStore):
-        self.openai_client = OpenAI(api_key=openai_api_key)
+        self.openai_client = get_openai_client(openai_api_key)
         self.vector_store = vector_store
 
     def chat(self, question: str) -> dict:
-        search_results = self.vector_store.search(question, top_k=5)
-        if not search_results:
-            return {
-                "answer": "申し訳ありませんが、この質問に関連する情報がドキュメントに見つかりませんでした。",
-                "sources": [],
-                "image_paths": [],
-            }
-        context = format_context(search_results)
-        user_prompt = RAG_PROMPT_TEMPLATE.format(context=context, question=question)
+        messages, sources, image_paths = self._prepare(question)
+        if not sources:
+            return {"answer": NO_RESULTS_ANSWER, "sources": [], "image_paths": []}
+        response = self.openai_client.chat.completions.create(
+            model="gpt-4o",
+            messages=messages,
+            temperature=0.3,
+            max_tokens=2000,
+        )
+        return {
+            "answer": response.choices[0].message.content or "",
+            "sources": sources,
+            "image_paths": image_paths,
+        }
+
+    def chat_stream(self, question: str) -> dict:
+        """chat と同じ形で返す。
+
+        ただし回答は "answer" の代わりに "stream"（トークンのイテレータ）で返す。
+        """
+        messages, sources, image_paths = self._prepare(question)
+        if not sources:
+            return {"stream": iter([NO_RESULTS_ANSWER]), "sources": [], "image_paths": []}
         response = self.openai_client.chat.completions.create(
             model="gpt-4o",
-            messages=[
-                {"role": "system", "content": SYSTEM_PROMPT},
-                {"role": "user", "content": user_prompt},
-            ],
+            messages=messages,
             temperature=0.3,
             max_tokens=2000,
+            stream=True,
         )
-        answer = response.choices[0].message.content or ""
-        all_image_paths = []
-        for result in search_results:
-            all_image_paths.extend(result.get("image_paths", []))
+        return {
+            "stream": (
+                event.choices[0].delta.content
+                for event in response
+                if event.choices and event.choices[0].delta.content
+            ),
+            "sources": sources,
+            "image_paths": image_paths,
+        }
+
+    def _prepare(self, question: str) -> tuple[list[dict], list[dict], list[str]]:
+        """検索結果から、LLMに送るメッセージ・参照元・画像パス（重複なし）を組み立てる。"""
+        search_results = self.vector_store.search(question, top_k=5)
+        user_prompt = RAG_PROMPT_TEMPLATE.format(
+            context=format_context(search_results), question=question
+        )
+        messages = [
+            {"role": "system", "content": SYSTEM_PROMPT},
+            {"role": "user", "content": user_prompt},
+        ]
         sources = [
             {"page_title": r["page_title"], "page_url": r["page_url"], "score": r["score"]}
             for r in search_results
         ]
-        return {
-            "answer": answer,
-            "sources": sources,
-            "image_paths": list(set(all_image_paths)),
-        }
+        image_paths = list({path for r in search_results for path in r.get("image_paths", [])})
+        return messages, sources, image_paths
 
 
 # ==================== ユーティリティ ====================
 
+# URL末尾の「タイトル-ID」またはIDのみの部分から32桁のページIDを取り出す
+_PAGE_ID_RE = re.compile(r"(?:^|-)([0-9a-f]{32})$", re.IGNORECASE)
+_PAGE_ID_SEPARATOR_RE = re.compile(r"[,\n]")
+
+
+# 設定画面の再実行のたびに同じURLの並びを解析し直すため、結果をメモ化する
+@lru_cache(maxsize=1024)
 def extract_page_id_from_url(url: str) -> str:
     url = url.strip().rstrip("/")
-    last_part = url.split("/")[-1]
-    if "-" in last_part:
-        potential_id = last_part.split("-")[-1]
-        if len(potential_id) == 32:
-            return potential_id
-    if len(last_part) == 32:
-        return last_part
-    return url
+    match = _PAGE_ID_RE.search(url.rsplit("/", 1)[-1])
+    return match.group(1) if match else url
+
+
+def parse_page_ids(raw: str) -> list[str]:
+    """改行またはカンマ区切りのURL/IDの並びをページIDのリストにする。"""
+    return [
+        extract_page_id_from_url(line)
+        for line in _PAGE_ID_SEPARATOR_RE.split(raw)
+        if line.strip()
+    ]
+
+
+def get_chunk_count(vector_store: VectorStore, refresh: bool = False) -> int:
+    """インデックスのチャンク数を返す。
+
+    同期するか refresh を指定するまではセッション内の値を使い回す。
+    ただし0件は使い回さない（別のセッションや同期で登録された場合に、空のままにしないため）。
+    """
+    if refresh or not st.session_state.get("chunk_count"):
+        st.session_state.chunk_count = vector_store.get_stats()["total_chunks"]
+    return st.session_state.chunk_count
 
 
 def display_image(img_path: str):
@@ -665,34 +934,116 @@ def display_image(img_path: str):
 
 def run_sync(settings: dict) -> VectorStore:
     """Notionデータを同期してVectorStoreを返す。"""
-    raw = settings['notion_page_ids'].replace(",", "\n")
-    page_ids = []
-    for line in raw.strip().split("\n"):
-        line = line.strip()
-        if line:
-            page_id = extract_page_id_from_url(line)
-            if page_id:
-                page_ids.append(page_id)
-
+    page_ids = parse_page_ids(settings['notion_page_ids'])
     loader = NotionLoader(settings['notion_token'], page_ids)
-    pages = loader.load_all_pages()
-    st.info(f"{len(pages)}ページを取得")
-
     image_processor = ImageProcessor(settings['openai_api_key'])
-    for page in pages:
-        for image in page.images:
-            image_processor.process_image(image)
-
     chunker = Chunker()
-    all_chunks = []
-    for page in pages:
-        chunks = chunker.chunk_page(page)
-        all_chunks.extend(chunks)
-
-    vector_store = VectorStore(settings['openai_api_key'])
-    vector_store.clear()
-    vector_store.add_chunks(all_chunks)
+    vector_store = get_vector_store(settings['openai_api_key'])
+    page_count, chunk_count = asyncio.run(
+        _run_sync_pipeline(loader, image_processor, chunker, vector_store)
+    )
+    st.info(f"{page_count}ページを更新")
 
     save_last_sync_time()
-    st.success(f"同期完了: {len(all_chunks)}チャンク")
+    # 表示用の総チャンク数は同期直後に1度だけ数えておく
+    st.session_state.chunk_count = vector_store.get_stats()["total_chunks"]
+    st.success(f"同期完了: {chunk_count}チャンク")
     return vector_store
+
+
+SYNC_QUEUE_SIZE = 32
+SYNC_INDEX_BATCH_SIZE = 256
+
+
+async def _run_sync_pipeline(
+    loader: NotionLoader,
+    image_processor: ImageProcessor,
+    chunker: Chunker,
+    vector_store: VectorStore,
+) -> tuple[int, int]:
+    """取得→画像処理・チャンク化→埋め込み・登録を有界キューで繋ぎ、各段を並行に動かす。
+
+    前回同期から last_edited_time が変わっていないページは取得以降の処理をすべて省く。
+    """
+    page_ids = [page_id.strip() for page_id in loader.page_ids if page_id.strip()]
+    # マニフェストが無い・インデックスが空の場合は差分を信用せず全件作り直す
+    manifest = vector_store.load_manifest()
+    incremental = bool(manifest) and vector_store.collection.count() > 0
+    known_versions = manifest if incremental else {}
+    versions = {
+        page_id: known_versions[page_id] for page_id in page_ids if page_id in known_versions
+    }
+
+    page_queue: asyncio.Queue[NotionPage | None] = asyncio.Queue(maxsize=SYNC_QUEUE_SIZE)
+    chunk_queue: asyncio.Queue[tuple[NotionPage, list[Chunk]] | None] = asyncio.Queue(
+        maxsize=SYNC_QUEUE_SIZE
+    )
+    page_count = 0
+    chunk_count = 0
+
+    async def load_stage() -> None:
+        nonlocal page_count
+        async for page in loader.iter_pages(known_versions):
+            page_count += 1
+            await page_queue.put(page)
+        await page_queue.put(None)
+
+    def transform(page: NotionPage) -> list[Chunk]:
+        image_processor.process_images(page.images)
+        return chunker.chunk_page(page)
+
+    async def transform_stage() -> None:
+        # チャンク化もワーカースレッドで行い、イベントループ上の取得処理を止めない
+        while (page := await page_queue.get()) is not None:
+            await chunk_queue.put((page, await asyncio.to_thread(transform, page)))
+        await chunk_queue.put(None)
+
+    async def index_stage() -> None:
+        nonlocal chunk_count
+        pending: list[Chunk] = []
+        # 差分同期では全体クリアせず、更新ページ単位で削除する
+        cleared = incremental
+        upsert_task: asyncio.Task | None = None
+
+        async def flush() -> None:
+            nonlocal cleared, chunk_count, upsert_task
+            # 既存インデックスは最初の書き込み直前にクリアする
+            if not cleared:
+                await asyncio.to_thread(vector_store.clear)
+                cleared = True
+            batch = pending.copy()
+            pending.clear()
+            if not batch:
+                return
+            # 次バッチの埋め込みと前バッチのChroma書き込みを重ねる
+            embeddings = await vector_store.embed_batch_async([chunk.text for chunk in batch])
+            if upsert_task:
+                await upsert_task
+            upsert_task = asyncio.create_task(vector_store.upsert_async(batch, embeddings))
+            chunk_count += len(batch)
+
+        while (item := await chunk_queue.get()) is not None:
+            page, chunks = item
+            if incremental:
+                await asyncio.to_thread(vector_store.delete_page, page.id)
+            pending.extend(chunks)
+            # 子ページを含むページは更新を検知できないため、毎回取り直すよう時刻を記録しない
+            versions[page.id] = (
+                None
+                if page.metadata.get("has_child_pages")
+                else page.metadata.get("last_edited_time")
+            )
+            if len(pending) >= SYNC_INDEX_BATCH_SIZE:
+                await flush()
+        if pending or not cleared:
+            await flush()
+        if upsert_task:
+            await upsert_task
+
+    await asyncio.gather(load_stage(), transform_stage(), index_stage())
+
+    # 設定から外されたページのチャンクを削除
+    for page_id in known_versions.keys() - set(page_ids):
+        await asyncio.to_thread(vector_store.delete_page, page_id)
+    vector_store.save_manifest(versions)
+    return page_count, chunk_count
@@ -3,25 +3,29 @@
 import streamlit as st
 from lib.auth import check_auth
 from lib.core import (
-    get_settings, VectorStore, run_sync,
+    get_settings, get_chunk_count, run_sync,
     save_page_ids, load_page_ids,
     save_notion_token, load_notion_token,
 )
 from lib.chat_logger import read_logs, get_log_stats
 
+LOG_PAGE_SIZE = 20
+
 
 st.title("管理者ページ")
 
 if not check_auth("admin"):
     st.stop()
 
+# 1回の再実行につき設定の取得は1度だけ行い、各タブで使い回す
+settings = get_settings()
+
 tab_sync, tab_settings, tab_logs = st.tabs(["データ同期", "Notion設定", "チャットログ"])
 
 # ==================== データ同期タブ ====================
 with tab_sync:
     st.subheader("Notion データ同期")
 
-    settings = get_settings()
     can_sync = settings.get('notion_token') and settings.get('openai_api_key') and settings.get('notion_page_ids')
 
     if st.button("Notionデータを同期", use_container_width=True, disabled=not can_sync):
@@ -38,8 +42,8 @@ with tab_sync:
     st.divider()
     st.subheader("インデックス統計")
     if st.session_state.get("vector_store"):
-        stats = st.session_state.vector_store.get_stats()
-        st.metric("チャンク数", stats.get("total_chunks", 0))
+        refresh = st.button("統計を更新", use_container_width=True)
+        st.metric("チャンク数", get_chunk_count(st.session_state.vector_store, refresh=refresh))
     else:
         st.info("未同期")
 
@@ -48,7 +52,7 @@ with tab_settings:
     st.subheader("Notion設定")
     st.caption("ここでの変更はアプリ再起動後も保持されます。")
 
-    current_token = load_notion_token() or get_settings().get('notion_token', '')
+    current_token = load_notion_token() or settings.get('notion_token', '')
     notion_token = st.text_input(
         "Notion Integration Token",
         type="password",
@@ -61,7 +65,7 @@ with tab_settings:
     st.divider()
     st.subheader("Notionページ設定")
 
-    current_page_ids = load_page_ids() or get_settings().get('notion_page_ids', '')
+    current_page_ids = load_page_ids() or settings.get('notion_page_ids', '')
     notion_pages_input = st.text_area(
         "読み込むNotionページ（1行に1つ）",
         value=current_page_ids,
@@ -87,9 +91,13 @@ with tab_logs:
 
     st.divider()
 
-    logs = read_logs()
-    if logs:
-        for entry in reversed(logs):
+    total = log_stats["total"]
+    if total:
+        num_pages = (total + LOG_PAGE_SIZE - 1) // LOG_PAGE_SIZE
+        page = st.number_input("ページ", min_value=1, max_value=num_pages, value=1, step=1)
+        # 新しい順に、表示するページの分だけを読み出す
+        logs = read_logs(limit=LOG_PAGE_SIZE, offset=(page - 1) * LOG_PAGE_SIZE)
+        for entry in logs:
             with st.expander(f"{entry.get('timestamp', '?')[:19]}  {entry.get('question', '')[:60]}"):
                 st.markdown(f"**質問:** {entry.get('question', '')}")
                 st.markdown(f"**回答:** {entry.get('answer', '')}")
@@ -3,7 +3,8 @@
 import streamlit as st
 from lib.auth import check_auth
 from lib.core import (
-    get_settings, RAGChain, VectorStore, display_image, run_sync, needs_resync,
+    get_settings, get_vector_store, get_chunk_count, RAGChain,
+    display_image, run_sync, needs_resync,
 )
 from lib.chat_logger import log_chat
 
@@ -27,8 +28,8 @@ can_sync = settings.get('notion_token') and settings.get('openai_api_key') and s
 if not st.session_state.get("vector_store"):
     openai_key = settings.get('openai_api_key')
     if openai_key:
-        vs = VectorStore(openai_key)
-        if vs.collection.count() > 0:
+        vs = get_vector_store(openai_key)
+        if get_chunk_count(vs) > 0:
             st.session_state.vector_store = vs
             st.session_state.synced = True
 
@@ -49,8 +50,8 @@ if not st.session_state.get("synced") and not can_sync:
 with st.sidebar:
     st.subheader("インデックス情報")
     if st.session_state.get("vector_store"):
-        stats = st.session_state.vector_store.get_stats()
-        st.metric("チャンク数", stats.get("total_chunks", 0))
+        refresh = st.button("統計を更新", use_container_width=True)
+        st.metric("チャンク数", get_chunk_count(st.session_state.vector_store, refresh=refresh))
     else:
         st.info("未同期")
 
@@ -60,17 +61,26 @@ with st.sidebar:
         st.session_state.messages = []
         st.rerun()
 
-# 過去のメッセージを表示
-for message in st.session_state.messages:
-    with st.chat_message(message["role"]):
-        st.markdown(message["content"])
-        if message.get("images"):
-            for img_path in message["images"]:
-                display_image(img_path)
-        if message.get("sources"):
-            with st.expander("参照元"):
-                for source in message["sources"]:
-                    st.markdown(f"- [{source['page_title']}]({source['page_url']}) (スコア: {source['score']:.2f})")
+
+@st.fragment
+def _render_history():
+    """過去のメッセージを表示（フラグメント内の操作では履歴部分だけが再実行される）"""
+    for message in st.session_state.messages:
+        with st.chat_message(message["role"]):
+            st.markdown(message["content"])
+            if message.get("images"):
+                for img_path in message["images"]:
+                    display_image(img_path)
+            if message.get("sources"):
+                with st.expander("参照元"):
+                    for source in message["sources"]:
+                        st.markdown(
+                            f"- [{source['page_title']}]({source['page_url']})"
+                            f" (スコア: {source['score']:.2f})"
+                        )
+
+
+_render_history()
 
 # チャット入力
 if prompt := st.chat_input("質問を入力してください...", disabled=not st.session_state.get("synced")):
@@ -82,11 +92,15 @@ if prompt := st.chat_input("質問を入力してください...", disabled=not
     with st.chat_message("assistant"):
         with st.spinner("回答を生成中..."):
             try:
-                settings = get_settings()
-                rag_chain = RAGChain(settings['openai_api_key'], st.session_state.vector_store)
-                result = rag_chain.chat(prompt)
+                # チェーンはセッション内で使い回し、ベクトルストアが差し替わったときだけ作り直す
+                rag_chain = st.session_state.get("rag_chain")
+                if rag_chain is None or rag_chain.vector_store is not st.session_state.vector_store:
+                    rag_chain = RAGChain(settings['openai_api_key'], st.session_state.vector_store)
+                    st.session_state.rag_chain = rag_chain
+                result = rag_chain.chat_stream(prompt)
 
-                st.markdown(result["answer"])
+                # 回答は生成されたトークンから順に表示する
+                answer = st.write_stream(result["stream"])
 
                 if result["image_paths"]:
                     st.subheader("関連画像")
@@ -100,11 +114,11 @@ if prompt := st.chat_input("質問を入力してください...", disabled=not
 
                 st.session_state.messages.append({
                     "role": "assistant",
-                    "content": result["answer"],
+                    "content": answer,
                     "images": result["image_paths"],
                     "sources": result["sources"],
                 })
 
-                log_chat(prompt, result["answer"], result["sources"])
+                log_chat(prompt, answer, result["sources"])
             except Exception as e:
                 st.error(f"エラー: {e}")
@@ -10,6 +10,7 @@ sys.path.insert(0, str(project_root))
 
 from src.indexer.chunker import Chunker
 from src.indexer.image_processor import ImageProcessor
+from src.indexer.pipeline import run_pipeline  # noqa: E402
 from src.indexer.vector_store import VectorStore
 from src.notion.loader import NotionLoader
 
@@ -24,44 +25,21 @@ def sync_notion_data():
     chunker = Chunker()
     vector_store = VectorStore()
 
-    # ベクトルストアをクリア（フル同期）
-    print("既存のインデックスをクリア...")
-    vector_store.clear()
-
-    # ページを読み込み
+    # ページ取得・画像処理・チャンク化+ベクトル化を並行に実行
     print("Notionからページを読み込み中...")
-    pages = loader.load_all_pages()
-    print(f"  {len(pages)}ページを取得\n")
-
-    total_chunks = 0
-    total_images = 0
 
-    for page in pages:
+    def on_page(page, chunks):
         print(f"処理中: {page.title}")
+        print(f"  画像: {len(page.images)}枚, チャンク: {len(chunks)}個")
 
-        # 画像を処理
-        images = page.images
-        if images:
-            print(f"  画像: {len(images)}枚")
-            for i, image in enumerate(images):
-                print(f"    [{i+1}/{len(images)}] 処理中...")
-                image_processor.process_image(image)
-            total_images += len(images)
-
-        # チャンク化
-        chunks = chunker.chunk_page(page)
-        print(f"  チャンク: {len(chunks)}個")
-        total_chunks += len(chunks)
-
-        # ベクトルストアに追加
-        vector_store.add_chunks(chunks)
+    result = run_pipeline(loader, image_processor, chunker, vector_store, on_page=on_page)
 
     # 統計情報
     stats = vector_store.get_stats()
     print("\n=== 同期完了 ===")
-    print(f"処理ページ数: {len(pages)}")
-    print(f"総チャンク数: {total_chunks}")
-    print(f"処理画像数: {total_images}")
+    print(f"処理ページ数: {result['pages']}")
+    print(f"総チャンク数: {result['chunks']}")
+    print(f"処理画像数: {result['images']}")
     print(f"インデックス内チャンク数: {stats['total_chunks']}")
 
 
@@ -0,0 +1,16 @@
+"""ルートで共有する依存オブジェクト"""
+
+from fastapi import Request
+
+from src.indexer.vector_store import VectorStore
+from src.rag.chain import RAGChain
+
+
+def get_vector_store(request: Request) -> VectorStore:
+    """起動時に生成したベクトルストアを返す"""
+    return request.app.state.vector_store
+
+
+def get_rag_chain(request: Request) -> RAGChain:
+    """起動時に生成したRAGチェーンを返す"""
+    return request.app.state.rag_chain
@@ -1,16 +1,30 @@
 """FastAPIアプリケーション"""
 
+from contextlib import asynccontextmanager
+
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
 
 from src.api.routes import chat, settings, sync
 from src.config.settings import get_settings
+from src.indexer.vector_store import VectorStore
+from src.rag.chain import RAGChain
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """起動時にベクトルストアとRAGチェーンを一度だけ生成し、全リクエストで共有する"""
+    app.state.vector_store = VectorStore()
+    app.state.rag_chain = RAGChain(vector_store=app.state.vector_store)
+    yield
+
 
 app = FastAPI(
     title="Notion Chatbot API",
     description="Notionページを読み込み質問に答えるチャットボットAPI",
     version="0.1.0",
+    lifespan=lifespan,
 )
 
 # CORS設定
@@ -1,8 +1,13 @@
 """チャットエンドポイント"""
 
-from fastapi import APIRouter
+from collections.abc import Iterator
+
+import orjson
+from fastapi import APIRouter, Depends
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
 
+from src.api.dependencies import get_rag_chain
 from src.rag.chain import RAGChain
 
 router = APIRouter(prefix="/chat", tags=["chat"])
@@ -24,9 +29,10 @@ class ChatResponseModel(BaseModel):
 
 
 @router.post("", response_model=ChatResponseModel)
-async def chat(request: ChatRequest) -> ChatResponseModel:
+async def chat(
+    request: ChatRequest, chain: RAGChain = Depends(get_rag_chain)
+) -> ChatResponseModel:
     """質問に対してRAGベースで回答を生成"""
-    chain = RAGChain()
 
     if request.history:
         response = chain.chat_with_history(request.message, request.history)
@@ -38,3 +44,16 @@ async def chat(request: ChatRequest) -> ChatResponseModel:
         sources=response.sources,
         image_paths=response.image_paths,
     )
+
+
+@router.post("/stream")
+async def chat_stream(
+    request: ChatRequest, chain: RAGChain = Depends(get_rag_chain)
+) -> StreamingResponse:
+    """質問に対する回答をServer-Sent Eventsで逐次返す"""
+
+    def event_stream() -> Iterator[bytes]:
+        for event in chain.chat_stream(request.message, request.history):
+            yield b"data: " + orjson.dumps(event) + b"\n\n"
+
+    return StreamingResponse(event_stream(), media_type="text/event-stream")
@@ -1,9 +1,10 @@
 """設定エンドポイント"""
 
 import os
+from functools import lru_cache
 from pathlib import Path
 
-from fastapi import APIRouter
+from fastapi import APIRouter, Request
 from pydantic import BaseModel
 
 router = APIRouter(prefix="/settings", tags=["settings"])
@@ -29,20 +30,29 @@ class SettingsResponse(BaseModel):
     openai_api_key_set: bool
 
 
-def _read_env_file() -> dict[str, str]:
-    """環境変数ファイルを読み込む"""
+@lru_cache(maxsize=1)
+def _parse_env_file(mtime_ns: int) -> dict[str, str]:
+    """環境変数ファイルをパースする（更新時刻をキーにキャッシュ）"""
     env_vars = {}
-    if ENV_FILE_PATH.exists():
-        for line in ENV_FILE_PATH.read_text().splitlines():
-            line = line.strip()
-            if line and not line.startswith("#") and "=" in line:
-                key, value = line.split("=", 1)
-                env_vars[key.strip()] = value.strip()
+    for line in ENV_FILE_PATH.read_text().splitlines():
+        line = line.strip()
+        if line and not line.startswith("#") and "=" in line:
+            key, value = line.split("=", 1)
+            env_vars[key.strip()] = value.strip()
     return env_vars
 
 
+def _read_env_file() -> dict[str, str]:
+    """環境変数ファイルを読み込む"""
+    try:
+        mtime_ns = ENV_FILE_PATH.stat().st_mtime_ns
+    except OSError:
+        return {}
+    return dict(_parse_env_file(mtime_ns))
+
+
 def _write_env_file(env_vars: dict[str, str]) -> None:
-    """環境変数ファイルを書き込む"""
+    """環境変数ファイルを書き込む（画面で扱わない設定もそのまま残す）"""
     lines = [
         "# Notion API",
         f"NOTION_TOKEN={env_vars.get('NOTION_TOKEN', '')}",
@@ -56,7 +66,14 @@ def _write_env_file(env_vars: dict[str, str]) -> None:
         f"CHROMA_PERSIST_DIR={env_vars.get('CHROMA_PERSIST_DIR', './data/chroma')}",
         f"IMAGE_STORAGE_DIR={env_vars.get('IMAGE_STORAGE_DIR', './data/images')}",
     ]
+    # 上にないキー（EMBEDDING_DIMENSIONS など）は消さずに末尾へ書き戻す
+    written_keys = {line.split("=", 1)[0] for line in lines if "=" in line}
+    extra_lines = [f"{key}={value}" for key, value in env_vars.items() if key not in written_keys]
+    if extra_lines:
+        lines += ["", *extra_lines]
     ENV_FILE_PATH.write_text("\n".join(lines) + "\n")
+    # 更新時刻の分解能によっては書き込み前と同じキーになるため、キャッシュを明示的に捨てる
+    _parse_env_file.cache_clear()
 
 
 def _mask_secret(value: str) -> str:
@@ -84,9 +101,10 @@ async def get_settings() -> SettingsResponse:
 
 
 @router.post("", response_model=SettingsResponse)
-async def update_settings(request: SettingsRequest) -> SettingsResponse:
+async def update_settings(request: SettingsRequest, http_request: Request) -> SettingsResponse:
     """設定を更新"""
     env_vars = _read_env_file()
+    original_vars = dict(env_vars)
 
     # 新しい値で更新（空でない場合のみ）
     if request.notion_token:
@@ -101,12 +119,18 @@ async def update_settings(request: SettingsRequest) -> SettingsResponse:
         env_vars["OPENAI_API_KEY"] = request.openai_api_key
         os.environ["OPENAI_API_KEY"] = request.openai_api_key
 
-    # ファイルに書き込み
-    _write_env_file(env_vars)
+    # 値が変わった場合のみファイルに書き込み、設定キャッシュをクリア
+    if env_vars != original_vars:
+        _write_env_file(env_vars)
+
+        from src.config.settings import get_settings
+        get_settings.cache_clear()
 
-    # 設定キャッシュをクリア
-    from src.config.settings import get_settings
-    get_settings.cache_clear()
+        # 共有のRAGチェーンは新しい設定で作り直す
+        # （OpenAIクライアントは埋め込み器・チェーンとも使うたびに最新のAPIキーで取得する）
+        from src.rag.chain import RAGChain
+        app_state = http_request.app.state
+        app_state.rag_chain = RAGChain(vector_store=app_state.vector_store)
 
     notion_token = env_vars.get("NOTION_TOKEN", "")
     openai_api_key = env_vars.get("OPENAI_API_KEY", "")
@@ -1,10 +1,18 @@
 """同期エンドポイント"""
 
-from fastapi import APIRouter, BackgroundTasks
+import multiprocessing
+import threading
+from concurrent.futures import Future, ProcessPoolExecutor
+from dataclasses import dataclass
+from functools import partial
+
+from fastapi import APIRouter, Depends
 from pydantic import BaseModel
 
+from src.api.dependencies import get_vector_store
 from src.indexer.chunker import Chunker
 from src.indexer.image_processor import ImageProcessor
+from src.indexer.pipeline import run_pipeline
 from src.indexer.vector_store import VectorStore
 from src.notion.loader import NotionLoader
 
@@ -19,73 +27,96 @@ class SyncStatus(BaseModel):
     stats: dict | None = None
 
 
-# グローバルな同期状態
-_sync_status = {"running": False, "message": "", "stats": None}
+@dataclass
+class SyncState:
+    """同期状態（_lock の保持中にのみ読み書きする）"""
 
+    running: bool = False
+    message: str = ""
+    stats: dict | None = None
 
-def _run_sync():
-    """バックグラウンドで同期を実行"""
-    global _sync_status
-    _sync_status["running"] = True
-    _sync_status["message"] = "同期中..."
 
-    try:
-        loader = NotionLoader()
-        image_processor = ImageProcessor()
-        chunker = Chunker()
-        vector_store = VectorStore()
+# グローバルな同期状態（同期完了のコールバックとリクエスト処理の両方から更新される）
+_sync_state = SyncState()
+_lock = threading.Lock()
 
-        # ベクトルストアをクリア
-        vector_store.clear()
 
-        # ページを読み込み
-        pages = loader.load_all_pages()
+# 同期はCPU負荷が高いため、APIのプロセスとは別のワーカープロセスで実行する
+# （spawn にするのは、スレッドを抱えたサーバープロセスを fork しないため）
+_mp_context = multiprocessing.get_context("spawn")
 
-        total_chunks = 0
-        total_images = 0
 
-        for page in pages:
-            # 画像を処理
-            images = page.images
-            for image in images:
-                image_processor.process_image(image)
-            total_images += len(images)
+def _run_sync() -> dict:
+    """同期を実行して統計情報を返す（ワーカープロセスで実行される）"""
+    loader = NotionLoader()
+    image_processor = ImageProcessor()
+    chunker = Chunker()
+    vector_store = VectorStore()
+
+    # ページ取得・画像処理・チャンク化+ベクトル化を並行に実行（編集されたページのみ）
+    return run_pipeline(loader, image_processor, chunker, vector_store)
 
-            # チャンク化
-            chunks = chunker.chunk_page(page)
-            total_chunks += len(chunks)
 
-            # ベクトルストアに追加
-            vector_store.add_chunks(chunks)
+def _submit_sync() -> Future:
+    """同期ごとに新しいワーカープロセスを起動して同期を投入する
 
-        stats = {
-            "pages": len(pages),
-            "chunks": total_chunks,
-            "images": total_images,
-        }
+    ワーカーを使い回すと、起動時の環境変数と get_settings() のキャッシュが残り、
+    設定画面で更新したトークン・ページID・APIキーが同期に反映されない。
+    また異常終了したプール（BrokenProcessPool）を使い続けることもなくなる。
+    """
+    executor = ProcessPoolExecutor(max_workers=1, mp_context=_mp_context)
+    try:
+        return executor.submit(_run_sync)
+    finally:
+        # 投入済みの同期は最後まで実行され、その後ワーカーは終了する
+        executor.shutdown(wait=False)
 
-        _sync_status["message"] = "同期完了"
-        _sync_status["stats"] = stats
 
+def _on_sync_done(vector_store: VectorStore, future: Future) -> None:
+    """ワーカープロセスでの同期結果を同期状態に反映する"""
+    stats = None
+    try:
+        stats = future.result()
+        message = "同期完了"
     except Exception as e:
-        _sync_status["message"] = f"同期エラー: {str(e)}"
+        message = f"同期エラー: {str(e)}"
 
-    finally:
-        _sync_status["running"] = False
+    # ワーカープロセスでの追加・削除（全件同期ではコレクションの作り直し）を読み込むため、
+    # 共有のストアはクライアントごと開き直す
+    try:
+        vector_store.reopen()
+    except Exception as e:
+        message = f"同期後の再読み込みエラー: {str(e)}"
+
+    with _lock:
+        _sync_state.message = message
+        if stats is not None:
+            _sync_state.stats = stats
+        _sync_state.running = False
 
 
 @router.post("", response_model=SyncStatus)
-async def start_sync(background_tasks: BackgroundTasks) -> SyncStatus:
+async def start_sync(vector_store: VectorStore = Depends(get_vector_store)) -> SyncStatus:
     """Notionデータの同期を開始"""
-    global _sync_status
+    # 判定と running の設定を一括で行い、同時リクエストによる二重起動を防ぐ
+    with _lock:
+        if _sync_state.running:
+            return SyncStatus(
+                status="running",
+                message="同期が既に実行中です",
+            )
+        _sync_state.running = True
+        _sync_state.message = "同期中..."
 
-    if _sync_status["running"]:
-        return SyncStatus(
-            status="running",
-            message="同期が既に実行中です",
-        )
-
-    background_tasks.add_task(_run_sync)
+    try:
+        future = _submit_sync()
+    except Exception as e:
+        # ワーカーを起動できなかった場合は実行中のままにしない
+        with _lock:
+            _sync_state.running = False
+            _sync_state.message = f"同期エラー: {str(e)}"
+        raise
+    future.add_done_callback(partial(_on_sync_done, vector_store))
 
     return SyncStatus(
         status="started",
@@ -96,23 +127,25 @@ async def start_sync(background_tasks: BackgroundTasks) -> SyncStatus:
 @router.get("/status", response_model=SyncStatus)
 async def get_sync_status() -> SyncStatus:
     """同期ステータスを取得"""
-    global _sync_status
+    with _lock:
+        running = _sync_state.running
+        message = _sync_state.message
+        stats = _sync_state.stats
 
-    if _sync_status["running"]:
+    if running:
         return SyncStatus(
             status="running",
-            message=_sync_status["message"],
+            message=message,
         )
 
     return SyncStatus(
         status="idle",
-        message=_sync_status["message"],
-        stats=_sync_status["stats"],
+        message=message,
+        stats=stats,
     )
 
 
 @router.get("/stats")
-async def get_index_stats() -> dict:
+async def get_index_stats(vector_store: VectorStore = Depends(get_vector_store)) -> dict:
     """インデックスの統計情報を取得"""
-    vector_store = VectorStore()
     return vector_store.get_stats()
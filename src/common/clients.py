@@ -0,0 +1,21 @@
+"""外部APIクライアントの共有インスタンス"""
+
+from functools import lru_cache
+
+from openai import OpenAI
+
+from src.config.settings import get_settings
+
+
+@lru_cache
+def _create_openai_client(api_key: str) -> OpenAI:
+    return OpenAI(api_key=api_key)
+
+
+def get_openai_client() -> OpenAI:
+    """OpenAIクライアントの共有インスタンスを返す
+
+    接続プールを使い回すため、同じAPIキーに対しては常に同じクライアントを返す。
+    設定画面でAPIキーが変更された場合は新しいクライアントになる。
+    """
+    return _create_openai_client(get_settings().openai_api_key)
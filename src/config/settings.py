@@ -1,11 +1,24 @@
 """アプリケーション設定管理"""
 
+import re
 from pathlib import Path
 from functools import lru_cache
 
 from pydantic_settings import BaseSettings, SettingsConfigDict
 
 
+# URL末尾の「タイトル-ID」またはIDのみの部分から32桁のページIDを取り出す
+_PAGE_ID_RE = re.compile(r"(?:^|-)([0-9a-f]{32})$", re.IGNORECASE)
+_ID_SEPARATOR_RE = re.compile(r"[,\n]")
+
+
+def extract_page_id_from_url(url: str) -> str:
+    """NotionのページURLからページIDを取り出す（IDでなければそのまま返す）"""
+    url = url.strip().rstrip("/")
+    match = _PAGE_ID_RE.search(url.rsplit("/", 1)[-1])
+    return match.group(1) if match else url
+
+
 class Settings(BaseSettings):
     """アプリケーション設定"""
 
@@ -18,7 +31,7 @@ class Settings(BaseSettings):
     # Notion API
     notion_token: str
     notion_database_ids: str = ""  # カンマ区切り（オプション）
-    notion_page_ids: str = ""  # カンマ区切り（オプション）
+    notion_page_ids: str = ""  # カンマまたは改行区切り、URLも可（オプション）
 
     # OpenAI API
     openai_api_key: str
@@ -29,6 +42,9 @@ class Settings(BaseSettings):
 
     # Model settings
     embedding_model: str = "text-embedding-3-small"
+    # 埋め込みの次元数（text-embedding-3系のみ。未指定ならモデルの既定次元）
+    # 変更すると次回の同期で全件作り直す
+    embedding_dimensions: int | None = None
     llm_model: str = "gpt-4o"
 
     # Chunking settings
@@ -43,7 +59,11 @@ class Settings(BaseSettings):
     @property
     def page_id_list(self) -> list[str]:
         """ページIDのリストを返す"""
-        return [page_id.strip() for page_id in self.notion_page_ids.split(",") if page_id.strip()]
+        return [
+            extract_page_id_from_url(page_id)
+            for page_id in _ID_SEPARATOR_RE.split(self.notion_page_ids)
+            if page_id.strip()
+        ]
 
 
 @lru_cache
@@ -24,6 +24,20 @@ class Chunker:
 
     HEADING_TYPES = {BlockType.HEADING_1, BlockType.HEADING_2, BlockType.HEADING_3}
 
+    # ブロックタイプごとのプレフィックスとサフィックス
+    PREFIX_MAP = {
+        BlockType.HEADING_1: "# ",
+        BlockType.HEADING_2: "## ",
+        BlockType.HEADING_3: "### ",
+        BlockType.BULLETED_LIST_ITEM: "• ",
+        BlockType.NUMBERED_LIST_ITEM: "1. ",
+        BlockType.QUOTE: "> ",
+        BlockType.CODE: "```\n",
+    }
+    SUFFIX_MAP = {
+        BlockType.CODE: "\n```",
+    }
+
     def __init__(self):
         settings = get_settings()
         self.chunk_size = settings.chunk_size
@@ -87,7 +101,9 @@ class Chunker:
     ) -> list[Chunk]:
         """セクションからチャンクを作成"""
         chunks = []
-        current_text = ""
+        # テキストは行のリストに溜めて確定時にだけ連結する（長さは別に保持）
+        current_parts: list[str] = []
+        current_len = 0
         current_images = []
         chunk_index = 0
 
@@ -98,7 +114,9 @@ class Chunker:
             # 画像がある場合は、画像の前後のテキストと一緒にチャンクを作成
             if block_images:
                 # 現在のテキストと画像を合わせてチャンクを作成
-                combined_text = current_text + "\n" + block_text if current_text else block_text
+                combined_text = (
+                    "\n".join([*current_parts, block_text]) if current_len else block_text
+                )
                 combined_images = current_images + block_images
 
                 if combined_text.strip() or combined_images:
@@ -114,13 +132,16 @@ class Chunker:
                     chunks.append(chunk)
                     chunk_index += 1
 
-                current_text = ""
+                current_parts = []
+                current_len = 0
                 current_images = []
             else:
                 # テキストのみの場合はサイズチェック
-                new_text = current_text + "\n" + block_text if current_text else block_text
+                new_len = current_len + 1 + len(block_text) if current_len else len(block_text)
+
+                if new_len > self.chunk_size:
+                    current_text = "\n".join(current_parts)
 
-                if len(new_text) > self.chunk_size:
                     # 現在のチャンクを保存
                     if current_text.strip():
                         chunk = Chunk(
@@ -138,14 +159,21 @@ class Chunker:
                     # オーバーラップを考慮して新しいチャンクを開始
                     if self.chunk_overlap > 0 and current_text:
                         overlap_text = current_text[-self.chunk_overlap :]
-                        current_text = overlap_text + "\n" + block_text
+                        current_parts = [overlap_text, block_text]
+                        current_len = len(overlap_text) + 1 + len(block_text)
                     else:
-                        current_text = block_text
+                        current_parts = [block_text]
+                        current_len = len(block_text)
                     current_images = []
                 else:
-                    current_text = new_text
+                    if current_len:
+                        current_parts.append(block_text)
+                    else:
+                        current_parts = [block_text]
+                    current_len = new_len
 
         # 残りのテキストをチャンクとして追加
+        current_text = "\n".join(current_parts)
         if current_text.strip():
             chunk = Chunk(
                 id=f"{page.id}_{section_index}_{chunk_index}",
@@ -162,34 +190,19 @@ class Chunker:
 
     def _get_block_text(self, block: NotionBlock) -> str:
         """ブロックからテキストを取得"""
-        text_parts = []
-
-        # ブロックタイプに応じたプレフィックス
-        prefix_map = {
-            BlockType.HEADING_1: "# ",
-            BlockType.HEADING_2: "## ",
-            BlockType.HEADING_3: "### ",
-            BlockType.BULLETED_LIST_ITEM: "• ",
-            BlockType.NUMBERED_LIST_ITEM: "1. ",
-            BlockType.QUOTE: "> ",
-            BlockType.CODE: "```\n",
-        }
-
-        suffix_map = {
-            BlockType.CODE: "\n```",
-        }
-
-        prefix = prefix_map.get(block.type, "")
-        suffix = suffix_map.get(block.type, "")
-
+        text = ""
         if block.text:
-            text_parts.append(f"{prefix}{block.text}{suffix}")
+            prefix = self.PREFIX_MAP.get(block.type, "")
+            suffix = self.SUFFIX_MAP.get(block.type, "")
+            # 段落など装飾のないブロックは連結を省く
+            text = f"{prefix}{block.text}{suffix}" if prefix or suffix else block.text
 
         # 画像の説明文もテキストとして追加
         if block.image and block.image.description:
-            text_parts.append(f"[画像説明: {block.image.description}]")
+            description = f"[画像説明: {block.image.description}]"
+            return f"{text}\n{description}" if text else description
 
-        return "\n".join(text_parts)
+        return text
 
     def _get_block_images(self, block: NotionBlock) -> list[str]:
         """ブロックから画像パスを取得"""
@@ -1,42 +1,179 @@
 """ベクトル化"""
 
-from openai import OpenAI
+import hashlib
+import sqlite3
+import threading
+from array import array
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
 
+import tiktoken
+from openai import BadRequestError, OpenAI
+
+from src.common.clients import get_openai_client
 from src.config.settings import get_settings
 
 
+def _is_token_limit_error(error: BadRequestError) -> bool:
+    """入力のトークン数が上限を超えたことによる拒否かどうか"""
+    if error.code in ("context_length_exceeded", "max_tokens_per_request"):
+        return True
+    message = str(error).lower()
+    return "maximum context length" in message or "tokens per request" in message
+
+
 class Embedder:
     """テキストをベクトル化"""
 
+    # 1リクエストあたりの入力数と合計トークン数の上限（APIの上限は2048入力・30万トークン）
+    MAX_BATCH_INPUTS = 2048
+    MAX_BATCH_TOKENS = 250_000
+    # 同時に送るリクエスト数
+    MAX_CONCURRENCY = 8
+    # 1クエリで引くキャッシュキーの数（SQLiteのパラメータ数上限を超えないようにする）
+    CACHE_LOOKUP_SIZE = 500
+    # 同一クエリの再埋め込みを避けるためのメモリ上のキャッシュ件数
+    MEMORY_CACHE_SIZE = 4096
+
     def __init__(self):
         settings = get_settings()
-        self.client = OpenAI(api_key=settings.openai_api_key)
         self.model = settings.embedding_model
+        try:
+            self.encoding = tiktoken.encoding_for_model(self.model)
+        except KeyError:
+            self.encoding = tiktoken.get_encoding("cl100k_base")
+        # 次元数を指定した場合のみリクエストに含める
+        # （ベクトルが小さいほどインデックスのメモリが減る）
+        self.options = (
+            {"dimensions": settings.embedding_dimensions} if settings.embedding_dimensions else {}
+        )
+
+        # モデル・次元数・テキストのハッシュをキーにしたディスクキャッシュ
+        # （未変更ページの再同期や同じ質問では埋め込みAPIを呼ばない）
+        self.cache_prefix = f"{self.model}:{settings.embedding_dimensions or ''}:"
+        settings.chroma_persist_dir.mkdir(parents=True, exist_ok=True)
+        self._cache = sqlite3.connect(
+            settings.chroma_persist_dir / "embed_cache.sqlite3",
+            check_same_thread=False,
+        )
+        self._cache.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings (key TEXT PRIMARY KEY, vector BLOB NOT NULL)"
+        )
+        self._cache_lock = threading.Lock()
+        self._embed_cached = lru_cache(maxsize=self.MEMORY_CACHE_SIZE)(self._embed_uncached)
+
+    @property
+    def client(self) -> OpenAI:
+        """OpenAIクライアント（設定画面でAPIキーが変わっても最新のキーのものを使う）"""
+        return get_openai_client()
 
     def embed(self, text: str) -> list[float]:
         """単一テキストをベクトル化"""
-        response = self.client.embeddings.create(
-            model=self.model,
-            input=text,
-        )
-        return response.data[0].embedding
+        return list(self._embed_cached(text))
+
+    def _embed_uncached(self, text: str) -> tuple[float, ...]:
+        return tuple(self.embed_batch([text])[0])
 
     def embed_batch(self, texts: list[str]) -> list[list[float]]:
-        """複数テキストをバッチでベクトル化"""
+        """複数テキストをバッチでベクトル化（キャッシュにないものだけAPIに問い合わせる）"""
         if not texts:
             return []
 
-        # OpenAI APIは最大2048入力をサポート、バッチ処理
-        batch_size = 100
-        all_embeddings = []
+        keys = [self._cache_key(text) for text in texts]
+        embeddings = self._load_cached(keys)
+        # 定型文など同一テキストは一度だけ問い合わせ、結果を元の位置に戻す
+        missing = [
+            (key, text) for key, text in dict(zip(keys, texts)).items() if key not in embeddings
+        ]
 
-        for i in range(0, len(texts), batch_size):
-            batch = texts[i : i + batch_size]
+        # 上限いっぱいまで詰めたバッチを並行にリクエストする（結果はバッチの順に返る）
+        batches = self._pack_batches(missing)
+        if len(batches) > 1:
+            max_workers = min(self.MAX_CONCURRENCY, len(batches))
+            with ThreadPoolExecutor(max_workers=max_workers) as executor:
+                results = list(
+                    executor.map(
+                        lambda batch: self._request_embeddings([text for _, text in batch]),
+                        batches,
+                    )
+                )
+        else:
+            results = [self._request_embeddings([text for _, text in batch]) for batch in batches]
+
+        for batch, batch_embeddings in zip(batches, results):
+            new_embeddings = {
+                key: embedding for (key, _), embedding in zip(batch, batch_embeddings)
+            }
+            self._store_cached(new_embeddings)
+            embeddings.update(new_embeddings)
+
+        return [embeddings[key] for key in keys]
+
+    def _pack_batches(self, items: list[tuple[str, str]]) -> list[list[tuple[str, str]]]:
+        """入力数・トークン数の上限を超えないように先頭から順にバッチへ詰める"""
+        batches = []
+        batch = []
+        batch_tokens = 0
+
+        for item in items:
+            tokens = len(self.encoding.encode(item[1], disallowed_special=()))
+            if batch and (
+                len(batch) >= self.MAX_BATCH_INPUTS
+                or batch_tokens + tokens > self.MAX_BATCH_TOKENS
+            ):
+                batches.append(batch)
+                batch = []
+                batch_tokens = 0
+            batch.append(item)
+            batch_tokens += tokens
+
+        if batch:
+            batches.append(batch)
+
+        return batches
+
+    def _request_embeddings(self, texts: list[str]) -> list[list[float]]:
+        """1リクエストでベクトル化（上限超過で拒否された場合は半分に分けて再試行）"""
+        try:
             response = self.client.embeddings.create(
                 model=self.model,
-                input=batch,
+                input=texts,
+                **self.options,
             )
-            embeddings = [item.embedding for item in response.data]
-            all_embeddings.extend(embeddings)
+        except BadRequestError as e:
+            # 分割で解消するのはトークン数の上限超過だけ（不正なモデル名などはそのまま送出）
+            if len(texts) == 1 or not _is_token_limit_error(e):
+                raise
+            mid = len(texts) // 2
+            return self._request_embeddings(texts[:mid]) + self._request_embeddings(texts[mid:])
+
+        return [item.embedding for item in response.data]
+
+    def _cache_key(self, text: str) -> str:
+        return self.cache_prefix + hashlib.sha256(text.encode()).hexdigest()
 
-        return all_embeddings
+    def _load_cached(self, keys: list[str]) -> dict[str, list[float]]:
+        """キャッシュ済みの埋め込みをキーごとに返す"""
+        unique_keys = list(dict.fromkeys(keys))
+        embeddings = {}
+        with self._cache_lock:
+            for i in range(0, len(unique_keys), self.CACHE_LOOKUP_SIZE):
+                batch = unique_keys[i : i + self.CACHE_LOOKUP_SIZE]
+                placeholders = ",".join("?" * len(batch))
+                rows = self._cache.execute(
+                    f"SELECT key, vector FROM embeddings WHERE key IN ({placeholders})",
+                    batch,
+                )
+                for key, blob in rows:
+                    vector = array("f")
+                    vector.frombytes(blob)
+                    embeddings[key] = vector.tolist()
+        return embeddings
+
+    def _store_cached(self, embeddings: dict[str, list[float]]) -> None:
+        """埋め込みをfloat32のバイト列としてキャッシュに保存"""
+        with self._cache_lock, self._cache:
+            self._cache.executemany(
+                "INSERT OR REPLACE INTO embeddings (key, vector) VALUES (?, ?)",
+                [(key, array("f", vector).tobytes()) for key, vector in embeddings.items()],
+            )
@@ -1,12 +1,14 @@
 """画像処理・説明生成"""
 
+import asyncio
 import base64
 import hashlib
 import mimetypes
 from pathlib import Path
 
 import httpx
-from openai import OpenAI
+import orjson
+from openai import AsyncOpenAI, BadRequestError
 
 from src.config.settings import get_settings
 from src.notion.models import ImageInfo
@@ -15,38 +17,130 @@ from src.notion.models import ImageInfo
 class ImageProcessor:
     """画像のダウンロードと説明生成を行う"""
 
+    # 同時ダウンロード数
+    MAX_DOWNLOADS = 16
+    # ダウンロード時に一度に書き出すバイト数
+    DOWNLOAD_CHUNK_SIZE = 64 * 1024
+    # 同時に行う説明生成リクエスト数（OpenAIのレート制限を考慮して控えめにする）
+    MAX_DESCRIPTIONS = 8
+    # レート制限(429)時のSDK側リトライ回数
+    MAX_RETRIES = 5
+
     def __init__(self):
         self.settings = get_settings()
         self.storage_dir = self.settings.image_storage_dir
         self.storage_dir.mkdir(parents=True, exist_ok=True)
-        self.openai_client = OpenAI(api_key=self.settings.openai_api_key)
+        self.description_cache_dir = self.storage_dir / ".desc_cache"
+        self.description_cache_dir.mkdir(exist_ok=True)
+        # 処理済み画像の (URL, キャプション) → ローカルパス・説明文
+        # 複数ページで共有される画像のダウンロードと説明生成を一度で済ませる
+        self.url_index_path = self.storage_dir / "url_index.json"
+        self._url_index = self._load_url_index()
+
+    def process_images(self, images: list[ImageInfo]) -> list[ImageInfo]:
+        """複数の画像を並行に処理"""
+        if not images:
+            return []
+        return asyncio.run(self.process_images_async(images))
 
     def process_image(self, image: ImageInfo) -> ImageInfo:
         """画像をダウンロードして説明を生成"""
-        if not image.url:
-            return image
+        return self.process_images([image])[0]
+
+    async def process_images_async(self, images: list[ImageInfo]) -> list[ImageInfo]:
+        """複数の画像を並行に処理
+
+        画像ごとにダウンロードが終わり次第その説明生成に進むため、
+        全画像のダウンロード完了を待たずに説明生成が始まる。
+        """
+        download_semaphore = asyncio.Semaphore(self.MAX_DOWNLOADS)
+        description_semaphore = asyncio.Semaphore(self.MAX_DESCRIPTIONS)
 
-        # ダウンロード
-        local_path = self._download_image(image.url)
-        if not local_path:
-            return image
+        async with (
+            httpx.AsyncClient(timeout=30.0, follow_redirects=True) as http_client,
+            AsyncOpenAI(
+                api_key=self.settings.openai_api_key,
+                max_retries=self.MAX_RETRIES,
+            ) as openai_client,
+        ):
+            async def process(key: str, url: str, caption: str | None) -> None:
+                cached = self._url_index.get(key)
+                if cached and Path(cached["local_path"]).exists():
+                    return
 
-        image.local_path = str(local_path)
+                # ダウンロード
+                async with download_semaphore:
+                    local_path = await self._download_image(http_client, url)
+                if not local_path:
+                    return
+
+                # 説明生成
+                async with description_semaphore:
+                    description = await self._generate_description(
+                        openai_client, local_path, caption, url
+                    )
+
+                self._url_index[key] = {
+                    "local_path": str(local_path),
+                    # 生成に失敗した場合はキャプションで代用し、次回あらためて生成する
+                    "description": description if description is not None else caption or "",
+                    "complete": description is not None,
+                }
+
+            # 同じ画像は一度だけ処理する
+            targets = {
+                self._url_index_key(image.url, image.caption): (image.url, image.caption)
+                for image in images
+                if image.url
+            }
+            await asyncio.gather(
+                *(process(key, url, caption) for key, (url, caption) in targets.items())
+            )
 
-        # 説明生成
-        description = self._generate_description(local_path, image.caption)
-        image.description = description
+        for image in images:
+            if not image.url:
+                continue
+            result = self._url_index.get(self._url_index_key(image.url, image.caption))
+            if result:
+                image.local_path = result["local_path"]
+                image.description = result["description"]
 
-        return image
+        return images
 
-    def _download_image(self, url: str) -> Path | None:
+    def _url_index_key(self, url: str, caption: str | None) -> str:
+        return f"{url}\n{caption or ''}"
+
+    def _load_url_index(self) -> dict[str, dict]:
+        """処理済み画像の索引を読み込む"""
+        try:
+            return orjson.loads(self.url_index_path.read_bytes())
+        except (OSError, orjson.JSONDecodeError):
+            return {}
+
+    def save_url_index(self) -> None:
+        """処理済み画像の索引を保存（ページごとではなく、画像処理がすべて終わってから一度だけ呼ぶ）
+
+        Notionにアップロードされた画像のURLは期限付きの署名URLで毎回変わるため、
+        次回以降も使える外部URLの画像と、説明生成まで完了したものだけを残す。
+        """
+        index = {
+            key: result
+            for key, result in self._url_index.items()
+            if result["complete"] and not self._is_signed_url(key)
+        }
+        self.url_index_path.write_bytes(orjson.dumps(index))
+
+    def _is_signed_url(self, url: str) -> bool:
+        """Notionにアップロードされた画像の期限付き署名URLか判定"""
+        return "X-Amz-Signature=" in url
+
+    async def _download_image(self, client: httpx.AsyncClient, url: str) -> Path | None:
         """画像をダウンロードしてローカルに保存"""
         try:
             # URLからハッシュを生成してファイル名に使用
-            url_hash = hashlib.md5(url.encode()).hexdigest()[:16]
+            url_hash = hashlib.blake2b(url.encode(), digest_size=8).hexdigest()
 
-            with httpx.Client(timeout=30.0, follow_redirects=True) as client:
-                response = client.get(url)
+            async with client.stream("GET", url) as response:
                 response.raise_for_status()
 
                 # Content-Typeから拡張子を推定
@@ -56,50 +150,118 @@ class ImageProcessor:
                 filename = f"{url_hash}{ext}"
                 local_path = self.storage_dir / filename
 
-                local_path.write_bytes(response.content)
-                return local_path
+                # 画像全体をメモリに載せず少しずつ書き出し、完了後に置き換える
+                partial_path = local_path.with_name(filename + ".part")
+                with partial_path.open("wb") as f:
+                    async for chunk in response.aiter_bytes(self.DOWNLOAD_CHUNK_SIZE):
+                        f.write(chunk)
+                partial_path.replace(local_path)
+
+            return local_path
 
         except Exception as e:
             print(f"画像ダウンロードエラー: {url} - {e}")
             return None
 
-    def _generate_description(self, image_path: Path, caption: str | None) -> str:
-        """GPT-4oを使って画像の説明を生成"""
+    async def _generate_description(
+        self, client: AsyncOpenAI, image_path: Path, caption: str | None, url: str | None = None
+    ) -> str | None:
+        """GPT-4oを使って画像の説明を生成（失敗時は None）
+
+        公開URLの画像はURLをそのまま渡し、base64エンコードと画像のアップロードを省く。
+        """
         try:
-            # 画像をbase64エンコード
-            image_data = image_path.read_bytes()
-            base64_image = base64.b64encode(image_data).decode("utf-8")
-
-            # MIMEタイプを推定
-            mime_type, _ = mimetypes.guess_type(str(image_path))
-            mime_type = mime_type or "image/png"
-
-            prompt = "この画像の内容を日本語で詳しく説明してください。図表やグラフの場合は、その内容や重要なポイントも含めて説明してください。"
-            if caption:
-                prompt += f"\n\nキャプション: {caption}"
-
-            response = self.openai_client.chat.completions.create(
-                model=self.settings.llm_model,
-                messages=[
-                    {
-                        "role": "user",
-                        "content": [
-                            {"type": "text", "text": prompt},
-                            {
-                                "type": "image_url",
-                                "image_url": {
-                                    "url": f"data:{mime_type};base64,{base64_image}",
-                                    "detail": "high",
-                                },
-                            },
-                        ],
-                    }
-                ],
-                max_tokens=500,
+            remote_url = (
+                url if url and url.startswith("https://") and not self._is_signed_url(url) else None
+            )
+
+            # 読み込み・ハッシュ計算・base64エンコードはCPUを使うため、イベントループの外で行う
+            cache_path, cached_description, base64_image = await asyncio.to_thread(
+                self._read_image, image_path, caption, remote_url is None
             )
 
-            return response.choices[0].message.content or ""
+            # 同じ画像・キャプションの説明は再生成しない
+            if cached_description is not None:
+                return cached_description
+
+            try:
+                description = await self._request_description(
+                    client, remote_url or self._data_url(image_path, base64_image), caption
+                )
+            except BadRequestError:
+                if remote_url is None:
+                    raise
+                # OpenAI側で画像を取得できなかった場合はbase64で送り直す
+                _, _, base64_image = await asyncio.to_thread(
+                    self._read_image, image_path, caption, True
+                )
+                description = await self._request_description(
+                    client, self._data_url(image_path, base64_image), caption
+                )
+
+            cache_path.write_text(description, encoding="utf-8")
+            return description
 
         except Exception as e:
             print(f"画像説明生成エラー: {image_path} - {e}")
-            return caption or ""
+            return None
+
+    async def _request_description(
+        self, client: AsyncOpenAI, image_url: str, caption: str | None
+    ) -> str:
+        """画像のURL（またはdata URL）を渡して説明を生成"""
+        prompt = "この画像の内容を日本語で詳しく説明してください。図表やグラフの場合は、その内容や重要なポイントも含めて説明してください。"
+        if caption:
+            prompt += f"\n\nキャプション: {caption}"
+
+        response = await client.chat.completions.create(
+            model=self.settings.llm_model,
+            messages=[
+                {
+                    "role": "user",
+                    "content": [
+                        {"type": "text", "text": prompt},
+                        {
+                            "type": "image_url",
+                            "image_url": {"url": image_url, "detail": "high"},
+                        },
+                    ],
+                }
+            ],
+            max_tokens=500,
+        )
+        return response.choices[0].message.content or ""
+
+    def _data_url(self, image_path: Path, base64_image: str) -> str:
+        """base64エンコードした画像をdata URLにする"""
+        # MIMEタイプを推定
+        mime_type, _ = mimetypes.guess_type(str(image_path))
+        mime_type = mime_type or "image/png"
+        return f"data:{mime_type};base64,{base64_image}"
+
+    def _read_image(
+        self, image_path: Path, caption: str | None, encode: bool
+    ) -> tuple[Path, str | None, str]:
+        """画像を読み込み、説明キャッシュのパス・キャッシュ済みの説明・base64を返す
+
+        encode が False の場合はbase64エンコードを省き、空文字を返す。
+        """
+        image_data = image_path.read_bytes()
+
+        cache_path = self._description_cache_path(image_data, caption)
+        if cache_path.exists():
+            return cache_path, cache_path.read_text(encoding="utf-8"), ""
+
+        # 画像をbase64エンコード
+        if not encode:
+            return cache_path, None, ""
+        return cache_path, None, base64.b64encode(image_data).decode("utf-8")
+
+    def _description_cache_path(self, image_data: bytes, caption: str | None) -> Path:
+        """画像内容とキャプションのハッシュから説明キャッシュのパスを決める
+
+        NotionのファイルURLは署名付きで毎回変わるため、URLではなく画像の中身をキーにする。
+        """
+        digest = hashlib.blake2b(image_data, digest_size=16)
+        digest.update(b"|" + (caption or "").encode())
+        return self.description_cache_dir / f"{digest.hexdigest()}.txt"
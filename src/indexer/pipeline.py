@@ -0,0 +1,144 @@
+"""同期パイプライン"""
+
+import queue
+import threading
+from collections.abc import Callable
+
+from src.indexer.chunker import Chunk, Chunker
+from src.indexer.image_processor import ImageProcessor
+from src.indexer.vector_store import VectorStore
+from src.notion.loader import NotionLoader
+from src.notion.models import NotionPage
+
+# ステージ間キューの上限（先行ステージが走りすぎてメモリを圧迫しないようにする）
+QUEUE_SIZE = 4
+# このチャンク数が溜まるごとにベクトル化・登録する
+INDEX_BATCH_SIZE = 256
+
+_DONE = object()
+
+
+def run_pipeline(
+    loader: NotionLoader,
+    image_processor: ImageProcessor,
+    chunker: Chunker,
+    vector_store: VectorStore,
+    on_page: Callable[[NotionPage, list[Chunk]], None] | None = None,
+) -> dict:
+    """ページ取得・画像処理・チャンク化とベクトル化を別スレッドで並行に実行
+
+    取得 → 画像処理 → チャンク化+ベクトル化 を有界キューで繋ぎ、
+    ページ取得の待ち時間を画像説明生成やベクトル化の裏に隠す。
+
+    前回のインデックス状態が残っていれば、編集されたページだけを差し替える（差分同期）。
+    """
+    # 差分同期できない場合（初回・状態ファイルの欠落・埋め込み設定の変更）は全ページを作り直す
+    index_state = vector_store.load_index_state()
+    incremental = bool(index_state) and vector_store.collection.count() > 0
+    if not incremental:
+        vector_store.clear()
+        index_state = {}
+
+    page_queue: queue.Queue = queue.Queue(maxsize=QUEUE_SIZE)
+    processed_queue: queue.Queue = queue.Queue(maxsize=QUEUE_SIZE)
+    stop = threading.Event()
+    errors: list[Exception] = []
+    stats = {"pages": 0, "chunks": 0, "images": 0}
+
+    def put(q: queue.Queue, item) -> None:
+        while not stop.is_set():
+            try:
+                q.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                continue
+
+    def get(q: queue.Queue):
+        while not stop.is_set():
+            try:
+                return q.get(timeout=0.1)
+            except queue.Empty:
+                continue
+        return _DONE
+
+    def load_stage() -> None:
+        pages = loader.iter_pages(index_state)
+        try:
+            for page in pages:
+                # 後段が失敗して中断された場合は、残りのページを取得せずに打ち切る
+                if stop.is_set():
+                    break
+                put(page_queue, page)
+        except Exception as e:
+            errors.append(e)
+        finally:
+            # 取得中のページも取り消す
+            pages.close()
+            put(page_queue, _DONE)
+
+    def image_stage() -> None:
+        try:
+            while (page := get(page_queue)) is not _DONE:
+                images = page.images
+                image_processor.process_images(images)
+                stats["images"] += len(images)
+                put(processed_queue, page)
+        except Exception as e:
+            errors.append(e)
+        finally:
+            put(processed_queue, _DONE)
+
+    threads = [
+        threading.Thread(target=load_stage, name="sync-loader", daemon=True),
+        threading.Thread(target=image_stage, name="sync-images", daemon=True),
+    ]
+    for thread in threads:
+        thread.start()
+
+    try:
+        pending: list[Chunk] = []
+        # 登録待ちのチャンクを持つページの last_edited_time（登録が済んでから状態に反映する）
+        pending_versions: dict[str, str | None] = {}
+        while (page := get(processed_queue)) is not _DONE:
+            chunks = chunker.chunk_page(page)
+            stats["pages"] += 1
+            stats["chunks"] += len(chunks)
+            if on_page:
+                on_page(page, chunks)
+
+            # 編集で減ったチャンクが残らないよう、ページ単位で古いチャンクを消してから登録する
+            if incremental:
+                vector_store.delete_by_page_id(page.id)
+            # 子ページを含むページは編集を検知できないため、毎回読み込み直す
+            pending_versions[page.id] = (
+                None
+                if page.metadata.get("has_child_pages")
+                else page.metadata.get("last_edited_time")
+            )
+
+            pending.extend(chunks)
+            if len(pending) >= INDEX_BATCH_SIZE:
+                vector_store.add_chunks(pending)
+                index_state.update(pending_versions)
+                pending = []
+                pending_versions = {}
+
+        # 前段でエラーが起きた場合は残りを登録せずに中断する
+        if errors:
+            raise errors[0]
+        vector_store.add_chunks(pending)
+        index_state.update(pending_versions)
+
+        # 設定やデータベースから外れたページのチャンクを削除する
+        for page_id in index_state.keys() - loader.page_versions.keys():
+            vector_store.delete_by_page_id(page_id)
+            del index_state[page_id]
+        vector_store.save_index_state(index_state)
+    finally:
+        stop.set()
+        for thread in threads:
+            thread.join()
+        # 処理済み画像の索引は、画像処理がすべて終わってからまとめて保存する
+        image_processor.save_url_index()
+
+    return stats
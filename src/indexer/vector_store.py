@@ -1,33 +1,61 @@
 """ChromaDB操作"""
 
-import json
-
 import chromadb
+import numpy as np
+import orjson
+from chromadb.api.client import SharedSystemClient
 from chromadb.config import Settings as ChromaSettings
 
 from src.config.settings import get_settings
 from src.indexer.chunker import Chunk
 from src.indexer.embedder import Embedder
 
+# メタデータはスカラーしか持てないため、画像パスのリストは区切り文字で連結して保存する
+IMAGE_PATH_SEPARATOR = "\n"
+
+
+def _join_image_paths(image_paths: list[str]) -> str:
+    return IMAGE_PATH_SEPARATOR.join(image_paths)
+
+
+def _split_image_paths(value: str) -> list[str]:
+    # 以前の形式（JSON配列）で保存されたチャンクも読めるようにする
+    if value.startswith("["):
+        return orjson.loads(value)
+    return value.split(IMAGE_PATH_SEPARATOR) if value else []
+
 
 class VectorStore:
     """ChromaDBを使ったベクトルストア"""
 
     COLLECTION_NAME = "notion_pages"
+    # ページIDごとの前回インデックス時の last_edited_time
+    INDEX_STATE_FILE = "index_state.json"
+    # 1回の upsert で登録するチャンク数
+    UPSERT_BATCH_SIZE = 1000
+    # 規模ごとのHNSWパラメータ (チャンク数の上限, M, construction_ef, search_ef)
+    # M と construction_ef はコレクション作成時にしか設定できないため、作り直す時点の件数で選ぶ
+    HNSW_CONFIGS = [
+        (100_000, 16, 64, 40),
+        (1_000_000, 24, 100, 100),
+        (None, 32, 128, 200),
+    ]
 
     def __init__(self):
         settings = get_settings()
         self.persist_dir = settings.chroma_persist_dir
         self.persist_dir.mkdir(parents=True, exist_ok=True)
+        self.index_state_path = self.persist_dir / self.INDEX_STATE_FILE
+        # 登録済みのベクトルを作ったときの埋め込み設定（変わった場合は差分同期できない）
+        self.embedding_config = {
+            "model": settings.embedding_model,
+            "dimensions": settings.embedding_dimensions,
+        }
 
-        self.client = chromadb.PersistentClient(
-            path=str(self.persist_dir),
-            settings=ChromaSettings(anonymized_telemetry=False),
-        )
-        self.collection = self.client.get_or_create_collection(
-            name=self.COLLECTION_NAME,
-            metadata={"hnsw:space": "cosine"},
-        )
+        self.client = self._create_client()
+        # 内容が変わるたびに増やす（検索結果のキャッシュを無効にするため）
+        self.generation = 0
+        self.reload_collection()
         self.embedder = Embedder()
 
     def add_chunks(self, chunks: list[Chunk]) -> None:
@@ -47,57 +75,161 @@ class VectorStore:
                 "page_id": chunk.page_id,
                 "page_title": chunk.page_title,
                 "page_url": chunk.page_url,
-                "image_paths": json.dumps(chunk.image_paths),
+                "image_paths": _join_image_paths(chunk.image_paths),
                 "section_index": chunk.metadata.get("section_index", 0),
             }
             for chunk in chunks
         ]
 
-        self.collection.upsert(
-            ids=ids,
-            embeddings=embeddings,
-            documents=documents,
-            metadatas=metadatas,
-        )
-
-    def search(self, query: str, top_k: int = 5) -> list[dict]:
-        """クエリに類似するチャンクを検索"""
+        # 1回の書き込みが大きくなりすぎないよう分割して登録
+        for i in range(0, len(ids), self.UPSERT_BATCH_SIZE):
+            end = i + self.UPSERT_BATCH_SIZE
+            self.collection.upsert(
+                ids=ids[i:end],
+                embeddings=embeddings[i:end],
+                documents=documents[i:end],
+                metadatas=metadatas[i:end],
+            )
+        self.generation += 1
+
+    def search(
+        self, query: str, top_k: int = 5, score_threshold: float | None = None
+    ) -> list[dict]:
+        """クエリに類似するチャンクを検索（score_threshold 未満の結果は除く）"""
         query_embedding = self.embedder.embed(query)
 
+        # 閾値がある場合はまず距離だけを取得し、残ったチャンクの本文とメタデータだけを読み出す
+        include = (
+            ["distances"]
+            if score_threshold is not None
+            else ["documents", "metadatas", "distances"]
+        )
         results = self.collection.query(
             query_embeddings=[query_embedding],
             n_results=top_k,
-            include=["documents", "metadatas", "distances"],
+            include=include,
         )
 
+        ids = results["ids"][0] if results["ids"] else []
+        if not ids:
+            return []
+
+        # コサイン距離を類似度に変換
+        if results["distances"]:
+            scores = 1.0 - np.asarray(results["distances"][0], dtype=np.float32)
+        else:
+            scores = np.ones(len(ids), dtype=np.float32)
+
+        if score_threshold is None:
+            documents = results["documents"][0]
+            metadatas = results["metadatas"][0] if results["metadatas"] else [{}] * len(ids)
+        else:
+            # 閾値未満の行は本文を読み出す前に落とす
+            keep = np.flatnonzero(scores >= score_threshold)
+            if keep.size == 0:
+                return []
+            ids = [ids[i] for i in keep]
+            scores = scores[keep]
+            fetched = self.collection.get(ids=ids, include=["documents", "metadatas"])
+            # get() の返却順は保証されないため、IDで引き直す
+            rows = dict(zip(fetched["ids"], zip(fetched["documents"], fetched["metadatas"])))
+            # 検索と読み出しの間に削除されたチャンクは除く
+            found = [i for i, chunk_id in enumerate(ids) if chunk_id in rows]
+            documents = [rows[ids[i]][0] for i in found]
+            metadatas = [rows[ids[i]][1] for i in found]
+            scores = scores[found]
+
         # 結果を整形
         search_results = []
-        if results["documents"] and results["documents"][0]:
-            for i, doc in enumerate(results["documents"][0]):
-                metadata = results["metadatas"][0][i] if results["metadatas"] else {}
-                distance = results["distances"][0][i] if results["distances"] else 0
-
-                # image_pathsをJSONからリストに変換
-                image_paths = json.loads(metadata.get("image_paths", "[]"))
-
-                search_results.append({
-                    "text": doc,
-                    "page_id": metadata.get("page_id", ""),
-                    "page_title": metadata.get("page_title", ""),
-                    "page_url": metadata.get("page_url", ""),
-                    "image_paths": image_paths,
-                    "score": 1 - distance,  # コサイン類似度に変換
-                })
+        for document, metadata, score in zip(documents, metadatas, scores):
+            metadata = metadata or {}
+            search_results.append({
+                "text": document,
+                "page_id": metadata.get("page_id", ""),
+                "page_title": metadata.get("page_title", ""),
+                "page_url": metadata.get("page_url", ""),
+                # image_pathsを区切り文字で分割してリストに戻す
+                "image_paths": _split_image_paths(metadata.get("image_paths", "")),
+                "score": float(score),
+            })
 
         return search_results
 
     def clear(self) -> None:
         """コレクションをクリア"""
+        expected_size = self.collection.count()
         self.client.delete_collection(self.COLLECTION_NAME)
+        self.reload_collection(expected_size)
+        self.index_state_path.unlink(missing_ok=True)
+
+    def delete_by_page_id(self, page_id: str) -> None:
+        """指定ページのチャンクを削除"""
+        self.collection.delete(where={"page_id": page_id})
+        self.generation += 1
+
+    def load_index_state(self) -> dict[str, str | None]:
+        """前回インデックス時のページごとの last_edited_time を読み込む
+
+        埋め込みモデル・次元数が前回と異なる場合は、既存のベクトルと混ぜられないため空を返す
+        （呼び出し側で全件同期になる）。
+        """
+        try:
+            state = orjson.loads(self.index_state_path.read_bytes())
+        except (OSError, orjson.JSONDecodeError):
+            return {}
+        if state.get("embedding") != self.embedding_config:
+            return {}
+        return state.get("pages", {})
+
+    def save_index_state(self, state: dict[str, str | None]) -> None:
+        """ページごとの last_edited_time を、ベクトル化に使った埋め込み設定と合わせて保存"""
+        self.index_state_path.write_bytes(
+            orjson.dumps({"embedding": self.embedding_config, "pages": state})
+        )
+
+    def reload_collection(self, expected_size: int = 0) -> None:
+        """コレクションを取得し直す（別プロセスの同期で作り直された後にも呼ぶ）
+
+        新規作成になる場合は expected_size の規模に合わせたHNSWパラメータで作成する。
+        """
         self.collection = self.client.get_or_create_collection(
             name=self.COLLECTION_NAME,
-            metadata={"hnsw:space": "cosine"},
+            metadata=self._collection_metadata(expected_size),
         )
+        self.generation += 1
+
+    def reopen(self) -> None:
+        """クライアントを開き直し、別プロセスでの書き込みを読み込む
+
+        Chromaは同じディレクトリを複数プロセスで開くことを想定しておらず、開いたままの
+        クライアントは他プロセスが追加・削除したベクトルを読み込まない（reload_collection でも
+        同じセグメントが返る）。プロセス内で共有されるシステムを破棄してから接続し直し、
+        古いシステム（SQLiteの接続や読み込み済みのHNSWセグメント）は差し替えた後に停止する。
+        """
+        # キャッシュを消すと古いクライアントからはシステムを引けなくなるため、先に取っておく
+        old_system = self.client._system
+        SharedSystemClient.clear_system_cache()
+        self.client = self._create_client()
+        self.reload_collection()
+        old_system.stop()
+
+    def _create_client(self):
+        return chromadb.PersistentClient(
+            path=str(self.persist_dir),
+            settings=ChromaSettings(anonymized_telemetry=False),
+        )
+
+    def _collection_metadata(self, expected_size: int) -> dict:
+        """想定チャンク数に応じたコレクションのメタデータ"""
+        for max_size, m, construction_ef, search_ef in self.HNSW_CONFIGS:
+            if max_size is None or expected_size < max_size:
+                break
+        return {
+            "hnsw:space": "cosine",
+            "hnsw:M": m,
+            "hnsw:construction_ef": construction_ef,
+            "hnsw:search_ef": search_ef,
+        }
 
     def get_stats(self) -> dict:
         """ベクトルストアの統計情報を取得"""
@@ -1,28 +1,98 @@
 """Notion APIクライアント"""
 
-from notion_client import Client
+import asyncio
+from collections.abc import Awaitable, Callable
+from typing import TypeVar
+
+from notion_client import APIErrorCode, APIResponseError, AsyncClient
 
 from src.config.settings import get_settings
 
+T = TypeVar("T")
+
 
 class NotionClient:
-    """Notion API操作用クライアント"""
+    """Notion API操作用クライアント
+
+    リクエストは非同期クライアントで並行に発行する。同期メソッドは単発の利用向けのラッパー。
+    """
+
+    # 同時リクエスト数の上限（Notionのレート制限は平均3リクエスト/秒）
+    MAX_CONCURRENCY = 8
+    # レート制限(429)時の再試行回数
+    MAX_RETRIES = 5
+    # 1リクエストで取得する件数（APIの上限）
+    PAGE_SIZE = 100
 
     def __init__(self):
         settings = get_settings()
-        self.client = Client(auth=settings.notion_token)
+        self.token = settings.notion_token
         self.database_ids = settings.database_id_list
         self.page_ids = settings.page_id_list
 
+    def create_async_client(self) -> AsyncClient:
+        """非同期クライアントを生成（使用するイベントループごとに作成し、aclose で閉じる）"""
+        return AsyncClient(auth=self.token)
+
     def get_database_pages(self, database_id: str) -> list[dict]:
+        """データベース内のすべてのページを取得"""
+        return self._run(
+            lambda client, semaphore: self.get_database_pages_async(client, semaphore, database_id)
+        )
+
+    def get_page(self, page_id: str) -> dict:
+        """ページ情報を取得"""
+        return self._run(
+            lambda client, semaphore: self.get_page_async(client, semaphore, page_id)
+        )
+
+    def get_page_blocks(self, page_id: str) -> list[dict]:
+        """ページ内のすべてのブロックを取得（再帰的）"""
+        return self._run(
+            lambda client, semaphore: self.get_page_blocks_async(client, semaphore, page_id)
+        )
+
+    def get_all_pages(self) -> list[dict]:
+        """すべての設定済みデータベース・ページからページを取得"""
+        return self._run(self.get_all_pages_async)
+
+    def _run(self, func: Callable[[AsyncClient, asyncio.Semaphore], Awaitable[T]]) -> T:
+        """非同期クライアントを用意して処理を実行"""
+
+        async def main() -> T:
+            async with self.create_async_client() as client:
+                return await func(client, asyncio.Semaphore(self.MAX_CONCURRENCY))
+
+        return asyncio.run(main())
+
+    async def _request(
+        self, semaphore: asyncio.Semaphore, method: Callable[..., Awaitable[dict]], **kwargs
+    ) -> dict:
+        """同時リクエスト数を制限してAPIを呼ぶ（レート制限時は指数バックオフで再試行）"""
+        for attempt in range(self.MAX_RETRIES + 1):
+            async with semaphore:
+                try:
+                    return await method(**kwargs)
+                except APIResponseError as e:
+                    if e.code != APIErrorCode.RateLimited or attempt == self.MAX_RETRIES:
+                        raise
+            # 待機中は枠を空けて他のリクエストを通す
+            await asyncio.sleep(2**attempt)
+
+    async def get_database_pages_async(
+        self, client: AsyncClient, semaphore: asyncio.Semaphore, database_id: str
+    ) -> list[dict]:
         """データベース内のすべてのページを取得"""
         pages = []
         cursor = None
 
         while True:
-            response = self.client.databases.query(
+            response = await self._request(
+                semaphore,
+                client.databases.query,
                 database_id=database_id,
                 start_cursor=cursor,
+                page_size=self.PAGE_SIZE,
             )
             pages.extend(response["results"])
 
@@ -32,48 +102,74 @@ class NotionClient:
 
         return pages
 
-    def get_page(self, page_id: str) -> dict:
+    async def get_page_async(
+        self, client: AsyncClient, semaphore: asyncio.Semaphore, page_id: str
+    ) -> dict:
         """ページ情報を取得"""
-        return self.client.pages.retrieve(page_id=page_id)
+        return await self._request(semaphore, client.pages.retrieve, page_id=page_id)
 
-    def get_page_blocks(self, page_id: str) -> list[dict]:
-        """ページ内のすべてのブロックを取得（再帰的）"""
-        return self._get_blocks_recursive(page_id)
+    async def get_page_blocks_async(
+        self, client: AsyncClient, semaphore: asyncio.Semaphore, block_id: str
+    ) -> list[dict]:
+        """ブロックを再帰的に取得（子ブロックの取得は並行に行う）
 
-    def _get_blocks_recursive(self, block_id: str) -> list[dict]:
-        """ブロックを再帰的に取得"""
+        続きのページを取得している間も、取得済みのブロックの子ブロックの取得を進める。
+        """
         blocks = []
+        parents = []
+        tasks = []
         cursor = None
 
-        while True:
-            response = self.client.blocks.children.list(
-                block_id=block_id,
-                start_cursor=cursor,
-            )
-
-            for block in response["results"]:
-                if block.get("has_children"):
-                    block["children"] = self._get_blocks_recursive(block["id"])
-                blocks.append(block)
-
-            if not response.get("has_more"):
-                break
-            cursor = response.get("next_cursor")
+        try:
+            while True:
+                response = await self._request(
+                    semaphore,
+                    client.blocks.children.list,
+                    block_id=block_id,
+                    start_cursor=cursor,
+                    page_size=self.PAGE_SIZE,
+                )
+                results = response["results"]
+                blocks.extend(results)
+
+                for block in results:
+                    if block.get("has_children"):
+                        parents.append(block)
+                        tasks.append(
+                            asyncio.ensure_future(
+                                self.get_page_blocks_async(client, semaphore, block["id"])
+                            )
+                        )
+
+                if not response.get("has_more"):
+                    break
+                cursor = response.get("next_cursor")
+
+            children = await asyncio.gather(*tasks)
+        except BaseException:
+            # 失敗・中断時は取得中の子ブロックも取り消す
+            for task in tasks:
+                task.cancel()
+            raise
+
+        for block, block_children in zip(parents, children):
+            block["children"] = block_children
 
         return blocks
 
-    def get_all_pages(self) -> list[dict]:
-        """すべての設定済みデータベース・ページからページを取得"""
-        all_pages = []
-
-        # データベースからページを取得
-        for db_id in self.database_ids:
-            pages = self.get_database_pages(db_id)
-            all_pages.extend(pages)
-
-        # 直接指定されたページを取得
-        for page_id in self.page_ids:
-            page = self.get_page(page_id)
-            all_pages.append(page)
-
-        return all_pages
+    async def get_all_pages_async(
+        self, client: AsyncClient, semaphore: asyncio.Semaphore
+    ) -> list[dict]:
+        """すべての設定済みデータベース・ページからページを並行に取得"""
+        database_pages, pages = await asyncio.gather(
+            asyncio.gather(
+                *(
+                    self.get_database_pages_async(client, semaphore, db_id)
+                    for db_id in self.database_ids
+                )
+            ),
+            asyncio.gather(
+                *(self.get_page_async(client, semaphore, page_id) for page_id in self.page_ids)
+            ),
+        )
+        return [page for db_pages in database_pages for page in db_pages] + list(pages)
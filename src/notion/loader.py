@@ -1,5 +1,8 @@
 """Notionページローダー"""
 
+import asyncio
+from collections.abc import Iterator
+
 from src.notion.client import NotionClient
 from src.notion.models import BlockType, ImageInfo, NotionBlock, NotionPage
 
@@ -9,35 +12,93 @@ class NotionLoader:
 
     def __init__(self):
         self.client = NotionClient()
+        # 直近の iter_pages で見つかった全ページの last_edited_time（スキップしたページも含む）
+        self.page_versions: dict[str, str | None] = {}
 
     def load_all_pages(self) -> list[NotionPage]:
         """すべてのページを読み込む"""
-        raw_pages = self.client.get_all_pages()
-        pages = []
-
-        for raw_page in raw_pages:
-            page = self.load_page(raw_page["id"])
-            pages.append(page)
-
-        return pages
+        return list(self.iter_pages())
+
+    def iter_pages(
+        self, known_versions: dict[str, str | None] | None = None
+    ) -> Iterator[NotionPage]:
+        """ページのブロックを並行に取得し、読み込めたページから1件ずつ返す
+
+        known_versions と last_edited_time が一致するページはブロックを取得せずに飛ばす。
+        """
+        known_versions = known_versions or {}
+        loop = asyncio.new_event_loop()
+        client = self.client.create_async_client()
+        semaphore = asyncio.Semaphore(self.client.MAX_CONCURRENCY)
+        pending = set()
+        try:
+            raw_pages = loop.run_until_complete(self.client.get_all_pages_async(client, semaphore))
+            self.page_versions = {
+                raw_page["id"]: raw_page.get("last_edited_time") for raw_page in raw_pages
+            }
+            pending = {
+                loop.create_task(self._load_page_async(client, semaphore, raw_page))
+                for raw_page in raw_pages
+                if not self._is_unchanged(raw_page, known_versions)
+            }
+            while pending:
+                done, pending = loop.run_until_complete(
+                    asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                )
+                for task in done:
+                    yield task.result()
+        finally:
+            # 途中で中断された場合は残りの取得を取り消す
+            if pending:
+                for task in pending:
+                    task.cancel()
+                loop.run_until_complete(asyncio.wait(pending))
+            loop.run_until_complete(client.aclose())
+            loop.close()
 
     def load_page(self, page_id: str) -> NotionPage:
         """単一ページを読み込む"""
         raw_page = self.client.get_page(page_id)
         raw_blocks = self.client.get_page_blocks(page_id)
-
+        return self._build_page(raw_page, raw_blocks)
+
+    async def _load_page_async(
+        self, client, semaphore: asyncio.Semaphore, raw_page: dict
+    ) -> NotionPage:
+        """取得済みのページ情報にブロックを非同期で取得して組み合わせる"""
+        raw_blocks = await self.client.get_page_blocks_async(client, semaphore, raw_page["id"])
+        return self._build_page(raw_page, raw_blocks)
+
+    def _is_unchanged(self, raw_page: dict, known_versions: dict[str, str | None]) -> bool:
+        """前回の読み込みから編集されていないページか判定"""
+        version = raw_page.get("last_edited_time")
+        return version is not None and known_versions.get(raw_page["id"]) == version
+
+    def _has_child_pages(self, raw_blocks: list[dict]) -> bool:
+        """子ページを含むか判定（子ページの編集は親ページの last_edited_time に反映されない）"""
+        stack = list(raw_blocks)
+        while stack:
+            block = stack.pop()
+            if block.get("type") == BlockType.CHILD_PAGE.value:
+                return True
+            stack.extend(block.get("children", []))
+        return False
+
+    def _build_page(self, raw_page: dict, raw_blocks: list[dict]) -> NotionPage:
+        """ページ情報とブロックからデータモデルを構築"""
         title = self._extract_title(raw_page)
         url = raw_page.get("url", "")
-        blocks = [self._parse_block(b) for b in raw_blocks]
+        blocks = self._parse_blocks(raw_blocks)
 
         return NotionPage(
-            id=page_id,
+            id=raw_page["id"],
             title=title,
             url=url,
             blocks=blocks,
             metadata={
                 "created_time": raw_page.get("created_time"),
                 "last_edited_time": raw_page.get("last_edited_time"),
+                "has_child_pages": self._has_child_pages(raw_blocks),
             },
         )
 
@@ -73,15 +134,31 @@ class NotionLoader:
 
         return "Untitled"
 
+    def _parse_blocks(self, raw_blocks: list[dict]) -> list[NotionBlock]:
+        """ブロックの木をパース
+
+        深くネストしたページでも再帰の上限に達しないよう、明示的なスタックで走査する。
+        親ブロックを先に作り、子ブロックはその children に順に追加していく。
+        """
+        blocks: list[NotionBlock] = []
+        # (未パースのブロック, 追加先のリスト)。ブロック順を保つため逆順に積む
+        stack = [(raw_block, blocks) for raw_block in reversed(raw_blocks)]
+        while stack:
+            raw_block, siblings = stack.pop()
+            block = self._parse_block(raw_block)
+            siblings.append(block)
+            stack.extend(
+                (child, block.children) for child in reversed(raw_block.get("children", []))
+            )
+        return blocks
+
     def _parse_block(self, block: dict) -> NotionBlock:
-        """ブロックをパース"""
+        """ブロック単体をパース（子ブロックは _parse_blocks で追加する）"""
         block_id = block.get("id", "")
         block_type_str = block.get("type", "unknown")
 
-        try:
-            block_type = BlockType(block_type_str)
-        except ValueError:
-            block_type = BlockType.UNKNOWN
+        # 未対応のタイプで例外を発生させないよう、値→メンバーの辞書から引く
+        block_type = BlockType._value2member_map_.get(block_type_str, BlockType.UNKNOWN)
 
         text = ""
         image = None
@@ -100,17 +177,11 @@ class NotionLoader:
         else:
             text = self._extract_rich_text(block_content.get("rich_text", []))
 
-        # 子ブロックをパース
-        children = []
-        if "children" in block:
-            children = [self._parse_block(child) for child in block["children"]]
-
         return NotionBlock(
             id=block_id,
             type=block_type,
             text=text,
             image=image,
-            children=children,
             metadata=metadata,
         )
 
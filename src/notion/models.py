@@ -31,7 +31,7 @@ class BlockType(Enum):
     UNKNOWN = "unknown"
 
 
-@dataclass
+@dataclass(slots=True)
 class ImageInfo:
     """画像情報"""
 
@@ -41,7 +41,7 @@ class ImageInfo:
     caption: str | None = None
 
 
-@dataclass
+@dataclass(slots=True)
 class NotionBlock:
     """Notionブロック"""
 
@@ -53,7 +53,7 @@ class NotionBlock:
     metadata: dict = field(default_factory=dict)
 
 
-@dataclass
+@dataclass(slots=True)
 class NotionPage:
     """Notionページ"""
 
@@ -62,17 +62,22 @@ class NotionPage:
     url: str
     blocks: list[NotionBlock] = field(default_factory=list)
     metadata: dict = field(default_factory=dict)
+    # images の走査結果（__slots__ では cached_property が使えないためフィールドで保持）
+    _images: list[ImageInfo] | None = field(default=None, init=False, repr=False, compare=False)
 
     @property
     def images(self) -> list[ImageInfo]:
-        """ページ内のすべての画像を取得"""
-
-        def collect_images(blocks: list[NotionBlock]) -> list[ImageInfo]:
-            images = []
-            for block in blocks:
-                if block.image:
-                    images.append(block.image)
-                images.extend(collect_images(block.children))
-            return images
-
-        return collect_images(self.blocks)
+        """ページ内のすべての画像を取得（初回のみ走査し、以降は結果を使い回す）"""
+        if self._images is not None:
+            return self._images
+
+        # 再帰せず明示的なスタックで走査（ブロック順を保つため逆順に積む）
+        images = []
+        stack = list(reversed(self.blocks))
+        while stack:
+            block = stack.pop()
+            if block.image:
+                images.append(block.image)
+            stack.extend(reversed(block.children))
+        self._images = images
+        return images
@@ -1,13 +1,23 @@
 """RAGチェーン"""
 
+from collections.abc import Iterator
 from dataclasses import dataclass
 
 from openai import OpenAI
 
+from src.common.clients import get_openai_client
 from src.config.settings import get_settings
+from src.indexer.vector_store import VectorStore
 from src.rag.prompts import RAG_PROMPT_TEMPLATE, SYSTEM_PROMPT, format_context
 from src.rag.retriever import Retriever
 
+# 関連するドキュメントが見つからなかった場合の回答
+NO_RESULTS_ANSWER = (
+    "申し訳ありませんが、この質問に関連する情報がドキュメントに見つかりませんでした。"
+)
+# 関連するドキュメントがない場合にプロンプトへ入れるコンテキスト
+NO_CONTEXT = "関連情報が見つかりませんでした。"
+
 
 @dataclass
 class ChatResponse:
@@ -21,107 +31,89 @@ class ChatResponse:
 class RAGChain:
     """RAGベースの回答生成チェーン"""
 
-    def __init__(self, top_k: int = 5):
+    def __init__(self, top_k: int = 5, vector_store: VectorStore | None = None):
         settings = get_settings()
-        self.client = OpenAI(api_key=settings.openai_api_key)
         self.model = settings.llm_model
-        self.retriever = Retriever(top_k=top_k)
+        self.retriever = Retriever(top_k=top_k, vector_store=vector_store)
+
+    @property
+    def client(self) -> OpenAI:
+        """OpenAIクライアント（設定画面でAPIキーが変わっても最新のキーのものを使う）"""
+        return get_openai_client()
 
     def chat(self, question: str) -> ChatResponse:
         """質問に対してRAGベースで回答を生成"""
-        # 関連ドキュメントを検索
-        search_results = self.retriever.retrieve(question)
-
-        if not search_results:
-            return ChatResponse(
-                answer="申し訳ありませんが、この質問に関連する情報がドキュメントに見つかりませんでした。",
-                sources=[],
-                image_paths=[],
-            )
-
-        # コンテキストを構築
-        context = format_context(search_results)
-
-        # プロンプトを構築
-        user_prompt = RAG_PROMPT_TEMPLATE.format(
-            context=context,
-            question=question,
-        )
-
-        # LLMで回答を生成
-        response = self.client.chat.completions.create(
-            model=self.model,
-            messages=[
-                {"role": "system", "content": SYSTEM_PROMPT},
-                {"role": "user", "content": user_prompt},
-            ],
-            temperature=0.3,
-            max_tokens=2000,
-        )
+        messages, sources, image_paths = self._prepare(question)
 
-        answer = response.choices[0].message.content or ""
-
-        # 画像パスを収集
-        all_image_paths = []
-        for result in search_results:
-            all_image_paths.extend(result.get("image_paths", []))
-
-        # ソース情報を整理
-        sources = [
-            {
-                "page_title": r["page_title"],
-                "page_url": r["page_url"],
-                "score": r["score"],
-            }
-            for r in search_results
-        ]
+        if not sources:
+            return ChatResponse(answer=NO_RESULTS_ANSWER, sources=[], image_paths=[])
 
         return ChatResponse(
-            answer=answer,
+            answer=self._complete(messages),
             sources=sources,
-            image_paths=list(set(all_image_paths)),  # 重複を除去
+            image_paths=image_paths,
         )
 
     def chat_with_history(
         self, question: str, history: list[dict]
     ) -> ChatResponse:
         """会話履歴を考慮してRAGベースで回答を生成"""
-        # 関連ドキュメントを検索
-        search_results = self.retriever.retrieve(question)
-
-        # コンテキストを構築
-        context = format_context(search_results) if search_results else "関連情報が見つかりませんでした。"
+        messages, sources, image_paths = self._prepare(question, history)
 
-        # プロンプトを構築
-        user_prompt = RAG_PROMPT_TEMPLATE.format(
-            context=context,
-            question=question,
+        return ChatResponse(
+            answer=self._complete(messages),
+            sources=sources,
+            image_paths=image_paths,
         )
 
-        # メッセージ履歴を構築
-        messages = [{"role": "system", "content": SYSTEM_PROMPT}]
+    def chat_stream(
+        self, question: str, history: list[dict] | None = None
+    ) -> Iterator[dict]:
+        """回答をトークン単位で逐次返す
 
-        # 過去の会話を追加
-        for h in history:
-            messages.append({"role": h["role"], "content": h["content"]})
+        最初に参照元を含む "sources" イベント、続いて "token" イベントを順に返し、
+        最後に "done" イベントで終わる。
+        """
+        messages, sources, image_paths = self._prepare(question, history)
+        yield {"type": "sources", "sources": sources, "image_paths": image_paths}
 
-        # 現在の質問を追加
-        messages.append({"role": "user", "content": user_prompt})
+        if not sources and not history:
+            yield {"type": "token", "content": NO_RESULTS_ANSWER}
+            yield {"type": "done"}
+            return
 
-        # LLMで回答を生成
-        response = self.client.chat.completions.create(
+        # LLMの出力を届いた順に返す
+        stream = self.client.chat.completions.create(
             model=self.model,
             messages=messages,
             temperature=0.3,
             max_tokens=2000,
+            stream=True,
         )
+        for event in stream:
+            if event.choices and event.choices[0].delta.content:
+                yield {"type": "token", "content": event.choices[0].delta.content}
 
-        answer = response.choices[0].message.content or ""
+        yield {"type": "done"}
+
+    def _prepare(
+        self, question: str, history: list[dict] | None = None
+    ) -> tuple[list[dict], list[dict], list[str]]:
+        """関連ドキュメントを検索し、LLMに送るメッセージ・参照元・画像パスを組み立てる"""
+        search_results = self.retriever.retrieve(question)
+
+        # プロンプトを構築
+        context = format_context(search_results) if search_results else NO_CONTEXT
+        user_prompt = RAG_PROMPT_TEMPLATE.format(
+            context=context,
+            question=question,
+        )
 
-        # 画像パスを収集
-        all_image_paths = []
-        for result in search_results:
-            all_image_paths.extend(result.get("image_paths", []))
+        # メッセージ履歴を構築（システムプロンプト・過去の会話・現在の質問の順）
+        messages = [{"role": "system", "content": SYSTEM_PROMPT}]
+        for h in history or []:
+            messages.append({"role": h["role"], "content": h["content"]})
+        messages.append({"role": "user", "content": user_prompt})
 
         # ソース情報を整理
         sources = [
@@ -133,8 +125,17 @@ class RAGChain:
             for r in search_results
         ]
 
-        return ChatResponse(
-            answer=answer,
-            sources=sources,
-            image_paths=list(set(all_image_paths)),
+        # 画像パスを収集（重複を除去）
+        image_paths = list({path for r in search_results for path in r.get("image_paths", [])})
+
+        return messages, sources, image_paths
+
+    def _complete(self, messages: list[dict]) -> str:
+        """LLMで回答を生成"""
+        response = self.client.chat.completions.create(
+            model=self.model,
+            messages=messages,
+            temperature=0.3,
+            max_tokens=2000,
         )
+        return response.choices[0].message.content or ""
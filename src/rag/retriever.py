@@ -1,22 +1,38 @@
 """検索ロジック"""
 
+from functools import lru_cache
+
 from src.indexer.vector_store import VectorStore
 
 
 class Retriever:
     """ベクトルストアから関連ドキュメントを検索"""
 
-    def __init__(self, top_k: int = 5):
-        self.vector_store = VectorStore()
+    # 同じ質問の再送・リトライで検索をやり直さないためのキャッシュ件数
+    CACHE_SIZE = 256
+
+    def __init__(self, top_k: int = 5, vector_store: VectorStore | None = None):
+        self.vector_store = vector_store or VectorStore()
         self.top_k = top_k
+        self._search_cached = lru_cache(maxsize=self.CACHE_SIZE)(self._search)
 
     def retrieve(self, query: str) -> list[dict]:
         """クエリに関連するドキュメントを検索"""
-        return self.vector_store.search(query, top_k=self.top_k)
+        return self._retrieve(query, None)
 
     def retrieve_with_threshold(
         self, query: str, score_threshold: float = 0.5
     ) -> list[dict]:
         """スコア閾値を超えるドキュメントのみを検索"""
-        results = self.retrieve(query)
-        return [r for r in results if r.get("score", 0) >= score_threshold]
+        return self._retrieve(query, score_threshold)
+
+    def _retrieve(self, query: str, score_threshold: float | None) -> list[dict]:
+        # ベクトルストアの世代をキーに含め、同期でインデックスが変わった後は検索し直す
+        return list(self._search_cached(self.vector_store.generation, query, score_threshold))
+
+    def _search(
+        self, generation: int, query: str, score_threshold: float | None
+    ) -> tuple[dict, ...]:
+        return tuple(
+            self.vector_store.search(query, top_k=self.top_k, score_threshold=score_threshold)
+        )
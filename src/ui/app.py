@@ -1,49 +1,202 @@
 """Streamlit チャットUI"""
 
-import re
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from itertools import chain
 from pathlib import Path
 
 import httpx
+import orjson
 import streamlit as st
 
+# プロジェクトルートをパスに追加（streamlit run src/ui/app.py で起動されるため）
+sys.path.insert(0, str(Path(__file__).parent.parent.parent))
+
+from src.config.settings import extract_page_id_from_url  # noqa: E402
+
 # APIのベースURL
 API_BASE_URL = "http://localhost:8000"
 
+# API接続に失敗した後、再接続を試みるまでの秒数
+API_RETRY_INTERVAL = 30.0
 
-def display_image(img_path: str):
-    """画像を表示"""
-    local_path = Path(img_path)
-    if local_path.exists():
-        st.image(str(local_path), use_container_width=True)
-    else:
-        # APIから取得を試みる
-        filename = local_path.name
-        st.image(f"{API_BASE_URL}/images/{filename}", use_container_width=True)
+# APIに送る会話履歴のターン数（1ターン = 質問と回答の2メッセージ）
+MAX_HISTORY_TURNS = 10
+
+# APIから並行に取得する画像の最大数
+MAX_IMAGE_FETCHES = 8
+
+# 回答中の画像参照 [IMAGE: パス] の開始タグ
+IMAGE_TAG = "[IMAGE:"
+
+
+@st.cache_resource
+def get_client() -> httpx.Client:
+    """APIクライアントを返す（再実行のたびに接続し直さないよう、接続プールを共有する）
+
+    APIはローカルで動くため、応答がない場合はすぐに諦めて画面が固まらないようにする。
+    時間のかかる呼び出し（チャット・設定の保存など）は呼び出し側で個別に延ばす。
+    """
+    return httpx.Client(
+        base_url=API_BASE_URL,
+        timeout=httpx.Timeout(2.0, connect=1.0),
+        limits=httpx.Limits(max_connections=100, max_keepalive_connections=20),
+    )
+
+
+@st.cache_data(ttl=3600, max_entries=512, show_spinner=False)
+def fetch_image_bytes(filename: str) -> bytes:
+    """APIから画像を取得（画像ごとにキャッシュし、履歴の画像を再実行のたびに取得し直さない）
+
+    取得に失敗した場合は例外を送出する（例外はキャッシュされないため、次の再実行で取得し直す）。
+    """
+    response = get_client().get(f"/images/{filename}", timeout=10.0)
+    response.raise_for_status()
+    return response.content
+
+
+def fetch_images(filenames: list[str]) -> list[bytes | None]:
+    """複数の画像を並行に取得（取得できなかった画像は None）"""
+
+    # スレッドからはキャッシュされた取得関数だけを呼び、表示などのStreamlitのAPIは呼ばない
+    def fetch(filename: str) -> bytes | None:
+        try:
+            return fetch_image_bytes(filename)
+        except httpx.HTTPError:
+            return None
+
+    if len(filenames) == 1:
+        return [fetch(filenames[0])]
+    with ThreadPoolExecutor(max_workers=min(MAX_IMAGE_FETCHES, len(filenames))) as executor:
+        return list(executor.map(fetch, filenames))
+
+
+def display_images(img_paths: list[str]):
+    """画像を表示（ローカルにない画像はAPIからまとめて取得する）"""
+    # 再実行のたびに履歴の全画像を stat しないよう、存在確認の結果をセッションに保持する
+    # （スクリプトは毎回実行し直されるため、lru_cache ではなく session_state に置く）
+    exists_cache = st.session_state.setdefault("image_exists", {})
+    for img_path in img_paths:
+        if img_path not in exists_cache:
+            exists_cache[img_path] = Path(img_path).exists()
+
+    remote_names = [Path(p).name for p in img_paths if not exists_cache[p]]
+    remote_images = iter(fetch_images(remote_names) if remote_names else [])
+
+    for img_path in img_paths:
+        if exists_cache[img_path]:
+            st.image(img_path, use_container_width=True)
+            continue
+        image = next(remote_images)
+        if image is not None:
+            st.image(image, use_container_width=True)
+        else:
+            st.warning(f"画像を取得できませんでした: {Path(img_path).name}")
 
 
 def extract_images_from_answer(answer: str) -> tuple[str, list[str]]:
     """回答から [IMAGE: パス] 形式の画像参照を抽出"""
-    pattern = r'\[IMAGE:\s*([^\]]+)\]'
-    image_paths = re.findall(pattern, answer)
-    clean_answer = re.sub(pattern, '', answer).strip()
-    return clean_answer, image_paths
-
-
-def extract_page_id_from_url(url: str) -> str:
-    """NotionのURLからページIDを抽出"""
-    # https://www.notion.so/PageName-xxxxx or https://notion.so/xxxxx
-    url = url.strip().rstrip("/")
-    # 最後の部分を取得
-    last_part = url.split("/")[-1]
-    # ハイフンで分割して最後の32文字がIDの場合
-    if "-" in last_part:
-        potential_id = last_part.split("-")[-1]
-        if len(potential_id) == 32:
-            return potential_id
-    # 32文字のIDの場合
-    if len(last_part) == 32:
-        return last_part
-    return url
+    # ほとんどの回答は画像参照を含まないため、その場合は走査せずに返す
+    if IMAGE_TAG not in answer:
+        return answer.strip(), []
+
+    # 正規表現を使わず、1回の走査で画像パスの抽出と参照の除去を行う
+    image_paths = []
+    parts = []
+    start = 0
+    i = answer.find(IMAGE_TAG)
+    while i != -1:
+        end = answer.find("]", i + len(IMAGE_TAG))
+        if end == -1:
+            break
+        path = answer[i + len(IMAGE_TAG) : end].lstrip()
+        if not path:
+            # 空（空白のみを含む）の参照はそのまま残す
+            i = answer.find(IMAGE_TAG, i + 1)
+            continue
+        image_paths.append(path)
+        parts.append(answer[start:i])
+        start = end + 1
+        i = answer.find(IMAGE_TAG, start)
+    parts.append(answer[start:])
+
+    return "".join(parts).strip(), image_paths
+
+
+def format_sources(sources: list[dict]) -> str:
+    """参照元をMarkdownのリストに整形"""
+    return "\n".join(
+        f"- [{source['page_title']}]({source['page_url']}) (スコア: {source['score']:.2f})"
+        for source in sources
+    )
+
+
+def add_message(message: dict) -> None:
+    """メッセージを追加（APIに送る会話履歴も同時に更新する）"""
+    st.session_state.messages.append(message)
+    st.session_state.chat_history.append({"role": message["role"], "content": message["content"]})
+
+
+@st.cache_data(ttl=5, show_spinner=False)
+def fetch_sidebar_data(include_settings: bool = True) -> tuple[dict | None, dict | None]:
+    """現在の設定とインデックス統計を並行に取得（取得しなかった・できなかったものは None）
+
+    Streamlitは操作のたびにスクリプト全体を再実行するため、数秒間は結果を使い回す。
+    """
+    client = get_client()
+    # スレッドではHTTPリクエストだけを行い、StreamlitのAPIは呼ばない
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        settings_future = executor.submit(client.get, "/settings") if include_settings else None
+        stats_future = executor.submit(client.get, "/sync/stats")
+
+    results = []
+    for future in (settings_future, stats_future):
+        try:
+            response = future.result() if future else None
+            results.append(response.json() if response and response.status_code == 200 else None)
+        except Exception:
+            results.append(None)
+    current_settings, stats = results
+    return current_settings, stats
+
+
+def load_sidebar_data() -> tuple[dict | None, dict | None]:
+    """サイドバーの設定と統計を取得
+
+    APIに接続できなかった場合は一定時間問い合わせを止め、再実行のたびに
+    タイムアウトを待って画面が固まらないようにする。
+    両方の認証情報が設定済みと確認できた後は、設定の取得を省く（保存時に確認し直す）。
+    """
+    confirmed_settings = st.session_state.get("confirmed_settings")
+
+    now = time.monotonic()
+    if now < st.session_state.get("api_retry_at", 0.0):
+        return confirmed_settings, None
+
+    current_settings, stats = fetch_sidebar_data(include_settings=confirmed_settings is None)
+    if stats is None:
+        st.session_state.api_retry_at = now + API_RETRY_INTERVAL
+
+    if confirmed_settings is not None:
+        return confirmed_settings, stats
+    if (
+        current_settings
+        and current_settings.get("notion_token_set")
+        and current_settings.get("openai_api_key_set")
+    ):
+        st.session_state.confirmed_settings = current_settings
+    return current_settings, stats
+
+
+@st.fragment(run_every=30)
+def index_stats():
+    """インデックス統計（同期の進み具合が分かるよう、この部分だけを定期的に更新する）"""
+    _, stats = load_sidebar_data()
+    if stats is not None:
+        st.metric("チャンク数", stats.get("total_chunks", 0))
+    else:
+        st.warning("API接続に失敗しました")
 
 
 # ページ設定
@@ -62,13 +215,7 @@ with st.sidebar:
     st.header("🔑 API設定")
 
     # 現在の設定を取得
-    current_settings = None
-    try:
-        response = httpx.get(f"{API_BASE_URL}/settings", timeout=5.0)
-        if response.status_code == 200:
-            current_settings = response.json()
-    except Exception:
-        pass
+    current_settings, _ = load_sidebar_data()
 
     with st.expander("API設定を編集", expanded=not (current_settings and current_settings.get("notion_token_set") and current_settings.get("openai_api_key_set"))):
         # Notion Token
@@ -104,14 +251,12 @@ with st.sidebar:
 
         # 保存ボタン
         if st.button("💾 設定を保存", use_container_width=True):
-            # ページIDを抽出
-            page_ids = []
-            for line in notion_pages_input.strip().split("\n"):
-                line = line.strip()
-                if line:
-                    page_id = extract_page_id_from_url(line)
-                    if page_id:
-                        page_ids.append(page_id)
+            # ページIDを抽出（extract_page_id_from_url が前後の空白を除くため、空行は空文字になる）
+            page_ids = [
+                page_id
+                for page_id in map(extract_page_id_from_url, notion_pages_input.splitlines())
+                if page_id
+            ]
 
             settings_data = {}
             if notion_token:
@@ -121,13 +266,13 @@ with st.sidebar:
             settings_data["notion_page_ids"] = ",".join(page_ids)
 
             try:
-                response = httpx.post(
-                    f"{API_BASE_URL}/settings",
-                    json=settings_data,
-                    timeout=10.0,
-                )
+                response = get_client().post("/settings", json=settings_data, timeout=10.0)
                 if response.status_code == 200:
                     st.success("設定を保存しました")
+                    # 保存した設定を次の再実行で取得し直す
+                    fetch_sidebar_data.clear()
+                    st.session_state.pop("api_retry_at", None)
+                    st.session_state.pop("confirmed_settings", None)
                     st.rerun()
                 else:
                     st.error("設定の保存に失敗しました")
@@ -143,7 +288,7 @@ with st.sidebar:
     if st.button("📥 Notionデータを同期", use_container_width=True):
         with st.spinner("同期を開始しています..."):
             try:
-                response = httpx.post(f"{API_BASE_URL}/sync", timeout=10.0)
+                response = get_client().post("/sync", timeout=5.0)
                 if response.status_code == 200:
                     st.success("同期を開始しました")
                 else:
@@ -154,7 +299,7 @@ with st.sidebar:
     # 同期ステータス確認
     if st.button("📊 同期ステータスを確認", use_container_width=True):
         try:
-            response = httpx.get(f"{API_BASE_URL}/sync/status", timeout=10.0)
+            response = get_client().get("/sync/status")
             if response.status_code == 200:
                 status = response.json()
                 st.info(f"ステータス: {status['status']}")
@@ -168,117 +313,129 @@ with st.sidebar:
 
     # インデックス統計
     st.subheader("📈 インデックス情報")
-    try:
-        response = httpx.get(f"{API_BASE_URL}/sync/stats", timeout=10.0)
-        if response.status_code == 200:
-            stats = response.json()
-            st.metric("チャンク数", stats.get("total_chunks", 0))
-    except Exception:
-        st.warning("API接続に失敗しました")
+    index_stats()
 
     st.divider()
 
     # 会話クリア
     if st.button("🗑️ 会話をクリア", use_container_width=True):
         st.session_state.messages = []
+        st.session_state.chat_history = []
         st.rerun()
 
 # チャット履歴の初期化
 if "messages" not in st.session_state:
     st.session_state.messages = []
+# APIに送る会話履歴（role と content のみ。add_message で messages と同時に追加する）
+if "chat_history" not in st.session_state:
+    st.session_state.chat_history = [
+        {"role": m["role"], "content": m["content"]} for m in st.session_state.messages
+    ]
 
 # 設定チェック
 if current_settings and not (current_settings.get("notion_token_set") and current_settings.get("openai_api_key_set")):
     st.warning("⚠️ 左側のサイドバーでAPI設定を完了してください")
 
-# 過去のメッセージを表示
-for message in st.session_state.messages:
-    with st.chat_message(message["role"]):
-        st.markdown(message["content"])
-
-        # 画像を表示
-        if message.get("images"):
-            for img_path in message["images"]:
-                display_image(img_path)
-
-        # ソースを表示
-        if message.get("sources"):
-            with st.expander("📄 参照元"):
-                for source in message["sources"]:
-                    st.markdown(
-                        f"- [{source['page_title']}]({source['page_url']}) "
-                        f"(スコア: {source['score']:.2f})"
-                    )
-
-# チャット入力
-if prompt := st.chat_input("質問を入力してください..."):
-    # ユーザーメッセージを追加
-    st.session_state.messages.append({"role": "user", "content": prompt})
-
-    with st.chat_message("user"):
-        st.markdown(prompt)
-
-    # APIにリクエスト
-    with st.chat_message("assistant"):
-        with st.spinner("回答を生成中..."):
+@st.fragment
+def chat_area():
+    """チャット履歴と入力欄（送信時はこの部分だけを再実行し、サイドバーは再描画しない）"""
+    # 過去のメッセージを表示
+    for message in st.session_state.messages:
+        with st.chat_message(message["role"]):
+            st.markdown(message["content"])
+
+            # 画像を表示
+            if message.get("images"):
+                display_images(message["images"])
+
+            # ソースを表示
+            if message.get("sources_md"):
+                with st.expander("📄 参照元"):
+                    st.markdown(message["sources_md"])
+
+    # チャット入力
+    if prompt := st.chat_input("質問を入力してください..."):
+        # ユーザーメッセージを追加
+        add_message({"role": "user", "content": prompt})
+
+        with st.chat_message("user"):
+            st.markdown(prompt)
+
+        # APIにリクエスト（回答は生成された分から順に表示する）
+        with st.chat_message("assistant"):
             try:
                 # 会話履歴を構築
-                history = [
-                    {"role": m["role"], "content": m["content"]}
-                    for m in st.session_state.messages[:-1]
-                ]
+                # 直近のターンだけを送り、会話が長くなってもリクエストが大きくならないようにする
+                history = st.session_state.chat_history[-1 - 2 * MAX_HISTORY_TURNS : -1]
 
-                response = httpx.post(
-                    f"{API_BASE_URL}/chat",
+                with get_client().stream(
+                    "POST",
+                    "/chat/stream",
                     json={"message": prompt, "history": history},
                     timeout=60.0,
-                )
-
-                if response.status_code == 200:
-                    data = response.json()
-                    answer = data["answer"]
-                    sources = data["sources"]
-                    image_paths = data["image_paths"]
-
-                    # 回答から画像参照を抽出
-                    clean_answer, referenced_images = extract_images_from_answer(answer)
-
-                    # すべての画像パスを統合
-                    all_images = list(set(image_paths + referenced_images))
-
-                    st.markdown(clean_answer)
-
-                    # 画像を表示
-                    if all_images:
-                        st.subheader("📷 関連画像")
-                        for img_path in all_images:
-                            display_image(img_path)
-
-                    # ソースを表示
-                    if sources:
-                        with st.expander("📄 参照元"):
-                            for source in sources:
-                                st.markdown(
-                                    f"- [{source['page_title']}]({source['page_url']}) "
-                                    f"(スコア: {source['score']:.2f})"
-                                )
-
-                    # セッションに保存
-                    st.session_state.messages.append({
-                        "role": "assistant",
-                        "content": clean_answer,
-                        "images": all_images,
-                        "sources": sources,
-                    })
-
-                else:
-                    st.error(f"APIエラー: {response.status_code}")
-                    st.session_state.messages.append({
-                        "role": "assistant",
-                        "content": "申し訳ありませんが、エラーが発生しました。",
-                    })
+                ) as response:
+                    if response.status_code == 200:
+                        sources = []
+                        image_paths = []
+                        answer_parts = []
+                        placeholder = st.empty()
+                        placeholder.markdown("回答を生成中...")
+
+                        # Server-Sent Events を1イベントずつ処理
+                        for line in response.iter_lines():
+                            if not line.startswith("data: "):
+                                continue
+                            event = orjson.loads(line[len("data: "):])
+                            if event["type"] == "sources":
+                                sources = event["sources"]
+                                image_paths = event["image_paths"]
+                            elif event["type"] == "token":
+                                answer_parts.append(event["content"])
+                                placeholder.markdown("".join(answer_parts))
+
+                        # 回答から画像参照を抽出
+                        clean_answer, referenced_images = extract_images_from_answer(
+                            "".join(answer_parts)
+                        )
+
+                        # すべての画像パスを統合
+                        # （表示順が再実行ごとに変わらないよう、順序を保って重複を除く）
+                        all_images = list(dict.fromkeys(chain(image_paths, referenced_images)))
+
+                        placeholder.markdown(clean_answer)
+
+                        # 画像を表示
+                        if all_images:
+                            st.subheader("📷 関連画像")
+                            display_images(all_images)
+
+                        # ソースを表示
+                        sources_md = format_sources(sources)
+                        if sources_md:
+                            with st.expander("📄 参照元"):
+                                st.markdown(sources_md)
+
+                        # セッションに保存
+                        add_message({
+                            "role": "assistant",
+                            "content": clean_answer,
+                            "images": all_images,
+                            "sources": sources,
+                            # 再実行のたびに整形し直さないよう、表示用の文字列も保存する
+                            "sources_md": sources_md,
+                        })
+
+                    else:
+                        st.error(f"APIエラー: {response.status_code}")
+                        add_message({
+                            "role": "assistant",
+                            "content": "申し訳ありませんが、エラーが発生しました。",
+                        })
 
             except httpx.TimeoutException:
                 st.error("タイムアウトしました。再度お試しください。")
             except Exception as e:
                 st.error(f"エラー: {e}")
+
+
+chat_area()